@@ -9,8 +9,6 @@ import urlparse
 import json
 from datetime import datetime
 
-from resources.lib.fsgo import fsgolib
-
 import xbmc
 import xbmcaddon
 import xbmcvfs
@@ -28,12 +26,10 @@ if not xbmcvfs.exists(addon_profile):
 
 _url = sys.argv[0]  # get the plugin url in plugin:// notation
 _handle = int(sys.argv[1])  # get the plugin handle as an integer number
-if addon.getSetting('verify_ssl') == 'false':
-    verify_ssl = False
-else:
-    verify_ssl = True
-
-fsgo = fsgolib(addon_profile, debug=True, verify_ssl=verify_ssl)
+_fsgo = None  # see get_fsgo()
+auth_free_actions = (None, 'dialog', 'channel_to_favs')
+router_actions = ('play_event', 'play_channel', 'list_events', 'list_events_by_date', 'list_upcoming_days',
+                  'show_auth_details', 'search', 'dialog', 'channel_to_favs')
 
 
 def addon_log(string):
@@ -41,24 +37,115 @@ def addon_log(string):
     xbmc.log(msg=msg, level=xbmc.LOGDEBUG)
 
 
-def play(channel_id, airing_id=None):
-    stream_url = fsgo.get_stream_url(channel_id, airing_id)
+def get_fsgo(settings):
+    """Return the fsgolib instance. It's imported and created on first use to keep actions that don't need it fast."""
+    global _fsgo
+    if _fsgo is None:
+        from resources.lib.fsgo import fsgolib
+        _fsgo = fsgolib(addon_profile, debug=True, verify_ssl=settings.verify_ssl, log_bodies=settings.log_bodies,
+                        log_requests=settings.log_requests, hedging=settings.hedge_requests)
+    return _fsgo
+
+
+class AddonSettings(object):
+    """The add-on settings and artwork, read once per invocation so hot loops don't call into Kodi."""
+    def __init__(self):
+        bitrate_setting = int(addon.getSetting('preferred_bitrate'))
+        if bitrate_setting == 0:
+            self.preferred_bitrate = 'highest'
+        elif bitrate_setting == 1:
+            self.preferred_bitrate = 'limit'
+        elif bitrate_setting == 2:
+            self.preferred_bitrate = 'ask'
+        elif bitrate_setting == 3:
+            self.preferred_bitrate = 'adaptive'
+        else:
+            self.preferred_bitrate = 'auto'
+        self.max_bitrate_allowed = int(addon.getSetting('max_bitrate_allowed'))
+        self.clock_12h = addon.getSetting('time_notation') == '0'
+        self.show_deportes = addon.getSetting('show_deportes')  # sent as is to the API
+        self.hide_replays = addon.getSetting('hide_replays') == 'true'
+        self.use_proxy = addon.getSetting('use_proxy') == 'true'
+        self.proxy_prefetch_count = int(addon.getSetting('proxy_prefetch_count'))
+        self.verify_ssl = addon.getSetting('verify_ssl') != 'false'
+        self.hedge_requests = addon.getSetting('hedge_requests') == 'true'
+        self.log_requests = addon.getSetting('log_requests') == 'true'
+        self.log_bodies = addon.getSetting('log_bodies') == 'true'
+        self.profile_actions = addon.getSetting('profile_actions') == 'true'
+        self.icon = addon.getAddonInfo('icon')
+        self.fanart = addon.getAddonInfo('fanart')
+
+
+def play(settings, channel_id, airing_id=None):
+    # the player handles the master manifest itself unless the user wants to limit, pick or measure the bitrate
+    fsgo = get_fsgo(settings)
+    fast_start = settings.preferred_bitrate in ('highest', 'adaptive')
+    stream_url = fsgo.get_stream_url(channel_id, airing_id, parse_manifest=not fast_start)
     if stream_url:
-        bitrate = select_bitrate(stream_url['bitrates'].keys())
-        if bitrate:
-            play_url = stream_url['bitrates'][bitrate]
-            playitem = xbmcgui.ListItem(path=play_url)
-            playitem.setProperty('IsPlayable', 'true')
-            xbmcplugin.setResolvedUrl(_handle, True, listitem=playitem)
+        if fast_start:
+            play_url = fsgo.get_playback_url(stream_url['manifest'])
+        else:
+            bitrate = select_bitrate(settings, stream_url['bitrates'], last_bitrate=stream_url.get('bitrate'))
+            if bitrate:
+                play_url = stream_url['bitrates'][bitrate]
+                fsgo.save_stream_bitrate(channel_id, airing_id, bitrate)
+            else:
+                play_url = None
+        if play_url:
+            if settings.use_proxy:
+                play_with_proxy(settings, play_url)
+            else:
+                playitem = xbmcgui.ListItem(path=play_url)
+                playitem.setProperty('IsPlayable', 'true')
+                xbmcplugin.setResolvedUrl(_handle, True, listitem=playitem)
     else:
         dialog('ok', language(30020), message=language(30021))
 
 
-def main_menu():
+def play_with_proxy(settings, play_url):
+    """Play the stream through the local prefetching HLS proxy. Blocks until playback has ended."""
+    from resources.lib.hlsproxy import hlsproxy
+    stream_url, _, header_string = play_url.partition('|')
+    proxy = hlsproxy(headers=dict(urlparse.parse_qsl(header_string)),
+                     prefetch_count=settings.proxy_prefetch_count, verify_ssl=settings.verify_ssl, debug=True)
+    proxy.start()
+    playitem = xbmcgui.ListItem(path=proxy.get_url(stream_url))
+    playitem.setProperty('IsPlayable', 'true')
+    xbmcplugin.setResolvedUrl(_handle, True, listitem=playitem)
+
+    player = xbmc.Player()
+    monitor = xbmc.Monitor()
+    started = False
+    waited = 0
+    # the proxy lives in this process, so keep it alive for as long as the player is playing from it
+    while not monitor.abortRequested():
+        if player.isPlaying() and proxy.is_local_url(get_playing_file(player)):
+            started = True
+        elif started or waited > 30:  # playback has ended or switched to another stream, or never started
+            break
+        waited += 1
+        if monitor.waitForAbort(1):
+            break
+    proxy.stop()
+
+
+def get_playing_file(player):
+    try:
+        return player.getPlayingFile()
+    except RuntimeError:  # playback stopped since isPlaying()
+        return ''
+
+
+def main_menu(settings):
     addon_log('Hello World!')  # print add-on version
-    items = [language(30023), language(30015), language(30026), language(30036), language(30030)]
+    items = [language(30048), language(30023), language(30015), language(30026), language(30036), language(30030)]
     for item in items:
-        if item == language(30023):
+        if item == language(30048):
+            params = {
+                'action': 'list_events',
+                'schedule_type': 'home'
+            }
+        elif item == language(30023):
             params = {
                 'action': 'list_events_by_date',
                 'schedule_type': 'all',
@@ -77,7 +164,7 @@ def main_menu():
             item = '[B]%s[/B]' % item
             params = {'action': 'show_auth_details'}
 
-        add_item(item, params)
+        add_item(settings, item, params)
     xbmcplugin.endOfDirectory(_handle)
 
 
@@ -95,36 +182,52 @@ def coloring(text, meaning):
     return colored_text
 
 
-def list_events(schedule_type, filter_date=False, search_query=None, search_filter=None):
+def list_events(settings, schedule_type, filter_date=False, search_query=None, search_filter=None, offset=0):
+    fsgo = get_fsgo(settings)
     items = []
+    event_count = 0
     now = datetime.now()
     date_today = now.date()
-
-    schedule = fsgo.get_schedule(schedule_type, filter_date=filter_date, deportes=addon.getSetting('show_deportes'),
-                                 search_query=search_query, search_filter=search_filter)
+    today_label = language(30023)
+    upcoming_label = language(30024)
+    upcoming_heading = language(30025)
+    favs_label = language(30038)
+
+    schedule = None
+    if schedule_type == 'search' and not offset:
+        # answer from the cached schedule when possible, the server also finds past events
+        schedule = fsgo.search_schedule(search_query, search_filter=search_filter, deportes=settings.show_deportes)
+    paged = not schedule and schedule_type in ('featured', 'search') and not filter_date
+    if schedule_type == 'home':
+        schedule = fsgo.get_home_schedule(deportes=settings.show_deportes)
+    elif not schedule:
+        schedule = fsgo.get_schedule(schedule_type, offset=offset, filter_date=filter_date,
+                                     deportes=settings.show_deportes, search_query=search_query,
+                                     search_filter=search_filter)
 
     for event in schedule:
-        if addon.getSetting('hide_replays') == 'true' and event['airings'][0]['replay']:
+        event_count += 1
+        airing = event.airing
+        if settings.hide_replays and airing.replay:
             continue
 
-        channel_id = event['airings'][0]['channel_id']
-        airing_id = event['airings'][0]['airing_id']
-        channel_name = event['airings'][0]['channel_name']
-        airing_date_obj = fsgo.parse_datetime(event['airings'][0]['airing_date'], localize=True)
+        channel_id = airing.channel_id
+        airing_id = airing.airing_id
+        channel_name = airing.channel_name
+        airing_date_obj = fsgo.utc_to_local(airing.airing_date)
         airing_date = airing_date_obj.date()
-        sport_tag = event.get('sport_tag')
 
-        if addon.getSetting('time_notation') == '0':  # 12 hour clock
+        if settings.clock_12h:
             time = airing_date_obj.strftime('%I:%M %p')
         else:
             time = airing_date_obj.strftime('%H:%M')
 
         if airing_date == date_today:
-            start_time = '%s %s' % (language(30023), time)
+            start_time = '%s %s' % (today_label, time)
         else:
             start_time = '%s %s' % (airing_date_obj.strftime('%Y-%m-%d'), time)
 
-        if event['airings'][0]['is_live']:
+        if airing.is_live:
             params = {
                 'action': 'play_event',
                 'channel_id': channel_id,
@@ -133,20 +236,20 @@ def list_events(schedule_type, filter_date=False, search_query=None, search_filt
             playable = True
             date_color = 'live'
         else:
-            message = '%s [B]%s[/B].' % (language(30024), start_time)
+            message = '%s [B]%s[/B].' % (upcoming_label, start_time)
             params = {
                 'action': 'dialog',
                 'dialog_type': 'ok',
-                'heading': language(30025),
+                'heading': upcoming_heading,
                 'message': message
             }
             playable = False
             date_color = 'upcoming'
 
         info = {
-            'title': event['title'],
-            'plot': event['title'],
-            'genre': sport_tag
+            'title': event.title,
+            'plot': event.title,
+            'genre': event.sport_tag
         }
 
         fav_params = {
@@ -156,42 +259,57 @@ def list_events(schedule_type, filter_date=False, search_query=None, search_filt
         }
 
         context_menu = {
-            'title': language(30038),
+            'title': favs_label,
             'function': 'RunPlugin',
             '_url': _url + '?' + urllib.urlencode(fav_params)
         }
 
-        try:
-            event_images = event['urls']
-            highest_res = 0
-            for image in event_images:
-                image_res = int(image['size'].split('_')[2])
-                if image_res > highest_res:
-                    art = {
-                        'thumb': image['src'],
-                        'fanart': image['src'],
-                        'cover': image['src']
-                    }
-                    highest_res = image_res
-        except KeyError:
+        if event.image:
+            art = {
+                'thumb': event.image,
+                'fanart': event.image,
+                'cover': event.image
+            }
+        else:
             art = None
 
-        list_title = '[B]%s[/B] %s: %s' % (coloring(start_time, date_color), coloring(channel_name, 'channel'), event['title'])
-        if event['airings'][0]['replay']:
+        list_title = '[B]%s[/B] %s: %s' % (coloring(start_time, date_color), coloring(channel_name, 'channel'), event.title)
+        if airing.replay:
             list_title = '%s [B]%s[/B]' % (list_title, coloring('(R)', 'replay'))
 
-        items = add_item(list_title, params, items=items, playable=playable, set_art=art,
+        items = add_item(settings, list_title, params, items=items, playable=playable, set_art=art,
                          set_info=info, context_menu=context_menu)
+
+    # a full page of featured or search results means there may be more
+    next_offset = None
+    if paged and event_count >= fsgo.page_size:
+        next_offset = offset + event_count
+        params = {
+            'action': 'list_events',
+            'schedule_type': schedule_type,
+            'offset': next_offset
+        }
+        if search_query:
+            params['search_query'] = search_query
+        if search_filter:
+            params['search_filter'] = search_filter
+        items = add_item(settings, '[B]%s[/B]' % language(30047), params, items=items)
     xbmcplugin.addDirectoryItems(_handle, items, len(items))
     xbmcplugin.endOfDirectory(_handle)
 
+    if next_offset:
+        # the listing is shown at this point, have the next page ready in the cache by the time it's opened
+        fsgo.prefetch_schedule(schedule_type, offset=next_offset, deportes=settings.show_deportes,
+                               search_query=search_query, search_filter=search_filter)
+
 
-def show_auth_details():
+def show_auth_details(settings):
+    fsgo = get_fsgo(settings)
     auth_details = fsgo.refresh_session()['user']['registration']
     tv_provider = auth_details['auth_provider']
     entitlements = ', '.join(sorted(auth_details['entitlements']))
     expiration_date_obj = fsgo.parse_datetime(auth_details['expires_on'], localize=True)
-    if addon.getSetting('time_notation') == '0':  # 12 hour clock
+    if settings.clock_12h:
         expiration_date = expiration_date_obj.strftime('%Y-%m-%d %I:%M %p')
     else:
         expiration_date = expiration_date_obj.strftime('%Y-%m-%d %H:%M')
@@ -208,8 +326,8 @@ def show_auth_details():
             fsgo.reset_credentials()
 
 
-def list_upcoming_days():
-    event_dates = fsgo.get_event_dates()
+def list_upcoming_days(settings):
+    event_dates = get_fsgo(settings).get_event_dates(deportes=settings.show_deportes)
     now = datetime.now()
     date_today = now.date()
 
@@ -222,7 +340,7 @@ def list_upcoming_days():
                 'filter_date': date
             }
 
-            add_item(title, params)
+            add_item(settings, title, params)
     xbmcplugin.endOfDirectory(_handle)
 
 
@@ -239,22 +357,20 @@ def ask_bitrate(bitrates):
         return None
 
 
-def select_bitrate(manifest_bitrates=None):
-    """Returns a bitrate while honoring the user's preference."""
-    bitrate_setting = int(addon.getSetting('preferred_bitrate'))
-    if bitrate_setting == 0:
-        preferred_bitrate = 'highest'
-    elif bitrate_setting == 1:
-        preferred_bitrate = 'limit'
-    else:
-        preferred_bitrate = 'ask'
+def select_bitrate(settings, streams, last_bitrate=None):
+    """Returns a bitrate while honoring the user's preference.
+    last_bitrate is the bitrate previously picked for the same stream and is reused instead of asking again."""
+    preferred_bitrate = settings.preferred_bitrate
 
+    manifest_bitrates = streams.keys()
     manifest_bitrates.sort(key=int, reverse=True)
     if preferred_bitrate == 'highest':
         return manifest_bitrates[0]
+    elif preferred_bitrate == 'auto':
+        return get_fsgo(settings).get_auto_bitrate(streams)
     elif preferred_bitrate == 'limit':
         allowed_bitrates = []
-        max_bitrate_allowed = int(addon.getSetting('max_bitrate_allowed'))
+        max_bitrate_allowed = settings.max_bitrate_allowed
         for bitrate in manifest_bitrates:
             if max_bitrate_allowed >= int(bitrate):
                 allowed_bitrates.append(str(bitrate))
@@ -263,6 +379,8 @@ def select_bitrate(manifest_bitrates=None):
         else:
             addon_log('No bitrate in stream matched the maximum bitrate allowed.')
             return None
+    elif last_bitrate in manifest_bitrates:
+        return last_bitrate
     else:
         return ask_bitrate(manifest_bitrates)
 
@@ -296,7 +414,7 @@ def get_user_input(heading):
         return None
 
 
-def search():
+def search(settings):
     search_query = get_user_input(language(30037))
     if search_query:
         options = [language(30040), language(30041)]
@@ -306,12 +424,12 @@ def search():
                 search_filter = 'events'
             else:
                 search_filter = None
-            list_events('search', search_query=search_query, search_filter=search_filter)
+            list_events(settings, 'search', search_query=search_query, search_filter=search_filter)
     else:
         addon_log('No search query provided.')
 
 
-def add_item(title, params, items=False, folder=True, playable=False, set_info=False, set_art=False,
+def add_item(settings, title, params, items=False, folder=True, playable=False, set_info=False, set_art=False,
              watched=False, set_content=False, context_menu=None):
     listitem = xbmcgui.ListItem(label=title)
     if playable:
@@ -321,8 +439,8 @@ def add_item(title, params, items=False, folder=True, playable=False, set_info=F
         listitem.setArt(set_art)
     else:
         art = {
-            'icon':  addon.getAddonInfo('icon'),
-            'fanart':  addon.getAddonInfo('fanart')
+            'icon': settings.icon,
+            'fanart': settings.fanart
         }
         listitem.setArt(art)
     if set_info:
@@ -366,7 +484,8 @@ def channel_to_favs(channel_name, channel_id):
     addon_log('channel_to_favs response: %s' % debug_dict)
 
 
-def authenticate(reg_code=None):
+def authenticate(settings, reg_code=None):
+    fsgo = get_fsgo(settings)
     try:
         fsgo.login(reg_code)
     except fsgo.LoginFailure as error:
@@ -376,14 +495,14 @@ def authenticate(reg_code=None):
             ok = dialog('yesno', language(30009), message=info_message, nolabel=language(30028),
                         yeslabel=language(30027))
             if ok:
-                authenticate(reg_code)
+                authenticate(settings, reg_code)
             else:
                 sys.exit(0)
         elif error.value == 'InvalidAuthN':
             try_again = dialog('yesno', language(30012), message=language(30013), nolabel=language(30028),
                                yeslabel=language(30029))
             if try_again:
-                authenticate()
+                authenticate(settings)
             else:
                 sys.exit(0)
         else:
@@ -391,33 +510,61 @@ def authenticate(reg_code=None):
             sys.exit(0)
 
 
-def router(paramstring):
+def router(paramstring, settings=None):
     """Router function that calls other functions depending on the provided paramstring."""
     params = dict(urlparse.parse_qsl(paramstring))
+    settings = settings or AddonSettings()
     if params:
         if params['action'] == 'play_event':
-            play(params['channel_id'], params['airing_id'])
+            play(settings, params['channel_id'], params['airing_id'])
         if params['action'] == 'play_channel':
-            play(params['channel_id'])
+            play(settings, params['channel_id'])
         elif params['action'] == 'list_events':
-            list_events(params['schedule_type'])
+            list_events(settings, params['schedule_type'], search_query=params.get('search_query'),
+                        search_filter=params.get('search_filter'), offset=int(params.get('offset', 0)))
         elif params['action'] == 'list_events_by_date':
-            list_events(params['schedule_type'], params['filter_date'])
+            list_events(settings, params['schedule_type'], params['filter_date'])
         elif params['action'] == 'list_upcoming_days':
-            list_upcoming_days()
+            list_upcoming_days(settings)
         elif params['action'] == 'show_auth_details':
-            show_auth_details()
+            show_auth_details(settings)
         elif params['action'] == 'search':
-            search()
+            search(settings)
         elif params['action'] == 'dialog':
             dialog(params['dialog_type'], params['heading'], params['message'])
         elif params['action'] == 'channel_to_favs':
             channel_to_favs(params['channel_name'], params['channel_id'])
     else:
-        main_menu()
+        main_menu(settings)
 
 
 def run():
-    if not fsgo.valid_session():
-        authenticate()
-    router(sys.argv[2][1:])  # trim the leading '?' from the plugin call paramstring
+    paramstring = sys.argv[2][1:]  # trim the leading '?' from the plugin call paramstring
+    action = dict(urlparse.parse_qsl(paramstring)).get('action')
+    settings = AddonSettings()
+    if settings.profile_actions:
+        from resources.lib.profiler import profiler
+        # the action names the stats file, so anything but the router's own actions is profiled as 'unknown'
+        if action is None:
+            profile_name = 'main_menu'
+        elif action in router_actions:
+            profile_name = action
+        else:
+            profile_name = 'unknown'
+        with profiler(os.path.join(addon_profile, 'profiles')).profile(profile_name):
+            handle(settings, paramstring, action)
+    else:
+        handle(settings, paramstring, action)
+
+
+def handle(settings, paramstring, action):
+    try:
+        if action not in auth_free_actions and not get_fsgo(settings).valid_session():
+            authenticate(settings)
+        router(paramstring, settings)
+        # the result has been handed to Kodi at this point so nobody is waiting for the session refresh
+        get_fsgo(settings).keep_alive()
+    finally:
+        if _fsgo:
+            _fsgo.save_cookies()
+            _fsgo.save_request_log()
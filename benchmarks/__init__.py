@@ -0,0 +1,5 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks of the add-on against a local stand-in for the FOX Sports GO APIs, run from the repository root,
+e.g. python -m benchmarks.run --events 5000 --latency 0.1
+"""
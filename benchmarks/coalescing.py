@@ -0,0 +1,88 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Load-tests concurrent plugin invocations sharing a profile and counts the upstream requests they make
+
+Usage: python -m benchmarks.coalescing [--events N] [--latency SECONDS] [--repeat N] [--concurrency N]
+[--output FILE]
+
+Every round starts --concurrency invocations of a router action at once with an empty cache, like a skin's widgets
+refreshing together. As fetches are coalesced per profile (see fsgolib.single_flight()), 'upstream' should stay at
+the requests a single invocation makes instead of growing with the concurrency. The 'expired_session' rounds start
+them with the session expired, 'upstream' counts the session requests of the logins they make.
+"""
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+from benchmarks.run import router_actions
+
+actions = ['home', 'live', 'featured', 'today', 'upcoming_days']
+
+
+def run_round(api, profile, paramstring, concurrency, path_prefix='/epg/'):
+    """Start concurrency invocations at once with an empty cache, return their measurements and the upstream
+    requests made to paths starting with path_prefix."""
+    common.clear_cache(profile)
+    api.reset_requests()
+    started = [(common.start_plugin(profile, api, paramstring), time.time())
+               for invocation in range(concurrency)]
+    runs = [common.finish_plugin(process, start) for process, start in started]
+    return runs, api.count_requests(path_prefix)
+
+
+def expire_session(profile):
+    """Make the session in the credentials of a profile look expired, as after the device was asleep."""
+    credentials_file = os.path.join(profile, 'credentials')
+    with open(credentials_file) as fh_credentials:
+        credentials = json.load(fh_credentials)
+    credentials['session_expires'] = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    with open(credentials_file, 'w') as fh_credentials:
+        json.dump(credentials, fh_credentials)
+
+
+def summarize_rounds(args, api, profile, paramstring, path_prefix='/epg/', before_round=None):
+    """Run a single invocation and then args.repeat rounds of args.concurrency ones, calling before_round before
+    each, and summarize them."""
+    if before_round:
+        before_round()
+    single_upstream = run_round(api, profile, paramstring, 1, path_prefix)[1]
+    runs, upstream = [], []
+    for run in range(args.repeat):
+        if before_round:
+            before_round()
+        round_runs, round_upstream = run_round(api, profile, paramstring, args.concurrency, path_prefix)
+        runs.extend(round_runs)
+        upstream.append(round_upstream)
+    return {
+        'upstream_single': single_upstream,  # made by one invocation alone
+        'upstream': common.summarize(upstream, 0),
+        'wall': common.summarize([run['wall'] for run in runs]),
+        'shown': common.summarize([run['shown'] for run in runs])
+    }
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help='invocations started at once')
+    parser.set_defaults(latency=0.2, repeat=3)
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    results = {'concurrency': args.concurrency}
+    try:
+        for name, paramstring in router_actions:
+            if name in actions:
+                results[name] = summarize_rounds(args, api, profile, paramstring)
+        results['expired_session'] = summarize_rounds(args, api, profile, dict(router_actions)['live'], '/sessions',
+                                                      lambda: expire_session(profile))
+    finally:
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
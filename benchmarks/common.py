@@ -0,0 +1,110 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Helpers shared by the benchmarks
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+import argparse
+
+from resources.lib.fsgo import fsgolib
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_parser(description):
+    """Return an argument parser with the options every benchmark takes."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--events', type=int, default=999, help='events in the schedule of the stand-in API')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in API waits per request')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    return parser
+
+
+def write_results(args, results):
+    """Print or save the results as JSON along with the configuration they were measured with."""
+    data = json.dumps({
+        'config': {
+            'events': args.events,
+            'latency': args.latency,
+            'repeat': args.repeat,
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'time': int(time.time())
+        },
+        'results': results
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh_output:
+            fh_output.write(data + '\n')
+    else:
+        print data
+
+
+def summarize(values, digits=4):
+    """Return the min, median, 95th and 99th percentile and max of measurements, e.g. seconds. Missing ones (None) are left
+    out, None is returned if there are none."""
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {
+        'runs': len(values),
+        'min': round(values[0], digits),
+        'median': round(values[len(values) // 2], digits),
+        'p95': round(values[min(int(len(values) * 0.95), len(values) - 1)], digits),
+        'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)], digits),
+        'max': round(values[-1], digits)
+    }
+
+
+def timed(function):
+    """Call function and return the seconds it took along with its result."""
+    start = time.time()
+    result = function()
+    return time.time() - start, result
+
+
+def make_profile(api):
+    """Return a new add-on profile folder logged in to the stand-in API."""
+    profile = tempfile.mkdtemp(prefix='fsgo-bench-')
+    get_fsgo(profile, api).login(reg_code='BENCH1')
+    return profile
+
+
+def get_fsgo(profile, api, **kwargs):
+    return fsgolib(profile, base_url=api.url, reg_url=api.url, **kwargs)
+
+
+def clear_cache(profile):
+    shutil.rmtree(os.path.join(profile, 'cache'), ignore_errors=True)
+
+
+def remove_profile(profile):
+    shutil.rmtree(profile, ignore_errors=True)
+
+
+def start_plugin(profile, api, paramstring='', settings=None, setting_cost=0):
+    """Start a plugin invocation in a new process, see benchmarks/plugin.py."""
+    return subprocess.Popen([sys.executable, '-m', 'benchmarks.plugin', profile, api.url, paramstring,
+                             json.dumps(settings or {}), str(setting_cost)], cwd=repo_path, stdout=subprocess.PIPE)
+
+
+def finish_plugin(process, start):
+    """Wait for a plugin invocation started at start and return its measurements with the process' wall time."""
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError('Plugin invocation failed with exit code %s.' % process.returncode)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['wall'] = time.time() - start
+    return result
+
+
+def run_plugin(profile, api, paramstring='', settings=None, setting_cost=0):
+    """Run a plugin invocation in a new process and return its measurements."""
+    start = time.time()
+    return finish_plugin(start_plugin(profile, api, paramstring, settings, setting_cost), start)
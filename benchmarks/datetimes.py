@@ -0,0 +1,53 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks parsing and localizing the airing dates of a schedule
+
+Usage: python -m benchmarks.datetimes [--events N] [--repeat N] [--output FILE]
+
+The previous approach (iso8601.parse_date followed by a timegm/fromtimestamp conversion per date) is compared with
+fsgolib.parse_datetime() and utc_to_local(), the first pass over a schedule filling their memos and the next ones
+(e.g. the date filter and the listing parsing the same dates again) using them.
+"""
+import calendar
+import tempfile
+from datetime import datetime
+
+import iso8601
+
+from benchmarks import common, fixtures
+from resources.lib.fsgo import fsgolib
+
+
+def parse_with_iso8601(airing_dates):
+    for airing_date in airing_dates:
+        utc_dt = iso8601.parse_date(airing_date)
+        datetime.fromtimestamp(calendar.timegm(utc_dt.timetuple())).replace(microsecond=utc_dt.microsecond)
+
+
+def parse_with_fsgolib(fsgo, airing_dates):
+    for airing_date in airing_dates:
+        fsgo.utc_to_local(fsgo.parse_datetime(airing_date))
+
+
+def main():
+    args = common.get_parser(__doc__.strip().splitlines()[0]).parse_args()
+    airing_dates = [event['airings'][0]['airing_date'] for event in fixtures.make_schedule(args.events)]
+    settings_folder = tempfile.mkdtemp(prefix='fsgo-bench-')
+    iso8601_times, first_pass_times, memoized_times = [], [], []
+    try:
+        for run in range(args.repeat):
+            iso8601_times.append(common.timed(lambda: parse_with_iso8601(airing_dates))[0])
+            fsgo = fsgolib(settings_folder)
+            first_pass_times.append(common.timed(lambda: parse_with_fsgolib(fsgo, airing_dates))[0])
+            memoized_times.append(common.timed(lambda: parse_with_fsgolib(fsgo, airing_dates))[0])
+    finally:
+        common.remove_profile(settings_folder)
+    common.write_results(args, {
+        'iso8601': common.summarize(iso8601_times, digits=6),
+        'fsgolib first pass': common.summarize(first_pass_times, digits=6),
+        'fsgolib memoized': common.summarize(memoized_times, digits=6)
+    })
+
+
+if __name__ == '__main__':
+    main()
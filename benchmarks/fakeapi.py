@@ -0,0 +1,198 @@
+﻿# -*- coding: utf-8 -*-
+"""
+A local stand-in for media-api.foxsportsgo.com and activation-adobe.foxsportsgo.com
+
+Both APIs are served on one port, point fsgolib's base_url and reg_url at fakeapi.url. Stalled and failing requests
+can be injected with inject_faults().
+"""
+import re
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import threading
+import BaseHTTPServer
+import SocketServer
+from datetime import datetime
+from urlparse import urlparse, parse_qsl
+
+from benchmarks import fixtures
+
+PAGE_REGEX = re.compile(r'/offset/(\d+)/size/(\d+)$')
+STREAM_REGEX = re.compile(r'^/platform/[^/]+/channel/([^/]+)(?:/airing/([^/]+))?$')
+SEGMENT_REGEX = re.compile(r'^/hls/(\d+)/segment(\d+)\.ts$')
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        if not issubclass(sys.exc_info()[0], socket.error):  # not a client that timed out and hung up
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class FakeApiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        fakeapi = self.server.fakeapi
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        parsed_path = urlparse(self.path)
+        fakeapi.add_request(method, parsed_path.path)
+        stalled, failed = fakeapi.draw_faults()
+        if fakeapi.latency:
+            time.sleep(fakeapi.latency)
+        if stalled:
+            time.sleep(fakeapi.stall_seconds)
+
+        if fakeapi.error_status or failed:
+            status, headers, body = fakeapi.error_status or 503, {}, ''
+        else:
+            status, headers, body = fakeapi.respond(method, parsed_path.path, dict(parse_qsl(parsed_path.query)))
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200 and method == 'GET' and self.headers.get('If-None-Match') == etag:
+            status, body = 304, ''
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class fakeapi(object):
+    def __init__(self, event_count=999, latency=0.0, session_lifetime=4 * 3600, segment_size=188 * 1000):
+        """Serve a schedule of event_count events (see fixtures.make_schedule()) after latency seconds per request.
+        Sessions expire session_lifetime seconds after they're registered or refreshed."""
+        self.event_count = event_count
+        self.latency = latency
+        self.session_lifetime = session_lifetime
+        self.segment = '\x47' * segment_size  # MPEG-TS sync bytes
+        self.events = fixtures.make_schedule(event_count)
+        self.server = None
+        self.url = None
+        self.error_status = None  # every request is answered with this status if set, e.g. 503 for an outage
+        self.stall_rate = 0.0  # fraction of the requests answered stall_seconds late, see inject_faults()
+        self.stall_seconds = 0.0
+        self.failure_rate = 0.0  # fraction of the requests answered with a 503 error
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.requests = []  # (method, path) of every request received
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+        self.server.fakeapi = self
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def inject_faults(self, stall_rate=0.0, stall_seconds=0.0, failure_rate=0.0, seed=0):
+        """Answer a random stall_rate of the requests stall_seconds late and a random failure_rate of them with a 503
+        error, on top of the latency. The requests are drawn from a sequence seeded with seed, so that the same
+        faults can be injected again."""
+        with self.lock:
+            self.stall_rate = stall_rate
+            self.stall_seconds = stall_seconds
+            self.failure_rate = failure_rate
+            self.random = random.Random(seed)
+
+    def draw_faults(self):
+        """Return whether the next request stalls and whether it fails."""
+        with self.lock:
+            return self.random.random() < self.stall_rate, self.random.random() < self.failure_rate
+
+    def add_request(self, method, path):
+        with self.lock:
+            self.requests.append((method, path))
+
+    def count_requests(self, path_prefix=''):
+        """Return the number of requests received for paths starting with path_prefix."""
+        with self.lock:
+            return len([path for method, path in self.requests if path.startswith(path_prefix)])
+
+    def reset_requests(self):
+        with self.lock:
+            del self.requests[:]
+
+    def respond(self, method, path, query):
+        """Return the status, the headers and the body of the response to a request."""
+        if path == '/ws/subscription/flow/foxSportGo.init':
+            return self.json_response({'code': 'BENCH1'})
+        elif path == '/ws/subscription/flow/v2_foxSportsGo.validate':
+            return self.json_response({'status': 'Success', 'access_token': 'BENCHTOKEN',
+                                       'auth_provider_name': 'Bench Cable'})
+        elif path == '/sessions/registered' or (path.startswith('/sessions/') and path.endswith('/refresh')):
+            headers = {'Authorization': 'Bearer bench-%s' % time.time()}
+            return self.json_response(fixtures.make_session(lifetime=self.session_lifetime), headers)
+        elif path == '/epg/ws/live/all':
+            events = [event for event in self.events if event['airings'][0]['is_live']]
+            return self.json_response(fixtures.make_schedule_response(events))
+        elif path.startswith('/epg/ws/featured/all/'):
+            events = [event for position, event in enumerate(self.events) if position % 4 == 0]
+            return self.page_response(path, events)
+        elif path.startswith('/epg/ws/search/'):
+            search = query.get('search', '').lower()
+            events = [event for event in self.events if search in event['title'].lower()]
+            if query.get('filter') == 'events':
+                events = [event for event in events if event['sport_tag']]
+            return self.page_response(path, events)
+        elif path == '/epg/ws/schedule':
+            start, end = self.parse_date(query.get('start_date')), self.parse_date(query.get('end_date'))
+            events = [event for event in self.events
+                      if (start is None or event['airings'][0]['airing_date'] >= start) and
+                      (end is None or event['airings'][0]['airing_date'] < end)]
+            return self.json_response(fixtures.make_schedule_response(events))
+        elif path == '/epg/ws/channel/all':
+            return self.json_response(fixtures.make_channels_response())
+        elif STREAM_REGEX.match(path):
+            return self.json_response({'stream': {'location': self.url + '/hls/master.m3u8'}})
+        elif path == '/hls/master.m3u8':
+            return 200, {'Content-Type': 'application/vnd.apple.mpegurl'}, fixtures.make_master_playlist()
+        elif path.startswith('/hls/') and path.endswith('/index.m3u8'):
+            return 200, {'Content-Type': 'application/vnd.apple.mpegurl'}, fixtures.make_variant_playlist()
+        elif SEGMENT_REGEX.match(path):
+            return 200, {'Content-Type': 'video/mp2t'}, self.segment
+        return 404, {}, ''
+
+    def json_response(self, data, headers=None):
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/json'
+        return 200, headers, json.dumps(data)
+
+    def page_response(self, path, events):
+        offset, size = [int(value) for value in PAGE_REGEX.search(path).groups()]
+        return self.json_response(fixtures.make_schedule_response(events[offset:offset + size], offset))
+
+    def parse_date(self, date_string):
+        """Return an API date parameter in the format of the airing dates for comparison, or None if it's open."""
+        try:
+            return fixtures.format_date((datetime.strptime(date_string[:19], '%Y-%m-%dT%H:%M:%S') -
+                                         datetime(1970, 1, 1)).total_seconds())
+        except (TypeError, ValueError):
+            return None
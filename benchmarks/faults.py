@@ -0,0 +1,99 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks fsgolib's timeouts, retries and hedging against a stand-in API that stalls or fails some requests
+
+Usage: python -m benchmarks.faults [--events N] [--latency SECONDS] [--repeat N] [--stall-rate RATE]
+[--stall SECONDS] [--failure-rate RATE] [--read-timeout SECONDS] [--output FILE]
+
+Every mode makes --repeat rounds of get_schedule('live') and get_stream_url() calls one after the other with the
+cache TTLs at 0, while the API answers --stall-rate of the requests --stall seconds late and --failure-rate of them
+with a 503 error, drawn from the same seeded sequence in every mode. 'baseline' waits for every response and never
+retries, 'timeouts+retries' times requests out after --read-timeout seconds and retries them as fsgolib does by
+default and 'hedging' also sends a second request when the first one is slow. The read timeout is scaled down with
+the stalls so that the benchmark runs in seconds. Per call, the latency of the successful calls (p50 is the median),
+the failed calls ('errors', 'error_rate') and the upstream requests are reported.
+"""
+import time
+
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+
+modes = ('baseline', 'timeouts+retries', 'hedging')
+
+
+def get_live_schedule(fsgo):
+    events = list(fsgo.get_schedule('live'))
+    if not events:  # the events of an error response aren't parsed, see fsgolib.iter_items()
+        raise ValueError('No live events.')
+    return events
+
+
+calls = [
+    ('get_schedule(live)', get_live_schedule),
+    ('get_stream_url', lambda fsgo: fsgo.get_stream_url('fs1', parse_manifest=False)['manifest'])
+]
+
+
+def get_mode_fsgo(profile, api, mode, args):
+    """Return an uncached fsgolib instance that times out, retries and hedges requests as the mode says."""
+    fsgo = common.get_fsgo(profile, api, hedging=mode == 'hedging')
+    fsgo.cache_ttls = dict.fromkeys(fsgo.cache_ttls, 0)
+    fsgo.stream_ttl = 0
+    if mode == 'baseline':
+        fsgo.timeouts = {'default': (None, None)}
+        fsgo.max_retries = 0
+    else:
+        fsgo.timeouts = dict((endpoint, (connect, args.read_timeout))
+                             for endpoint, (connect, read) in fsgo.timeouts.items())
+    return fsgo
+
+
+def run_mode(args, api, profile, mode):
+    fsgo = get_mode_fsgo(profile, api, mode, args)
+    times = dict((name, []) for name, call in calls)
+    errors = dict((name, 0) for name, call in calls)
+    api.inject_faults(args.stall_rate, args.stall, args.failure_rate)
+    api.reset_requests()
+    for run in range(args.repeat):
+        for name, call in calls:
+            start = time.time()
+            try:
+                call(fsgo)
+            except (IOError, ValueError):  # requests' exceptions are IOErrors
+                errors[name] += 1
+                continue
+            times[name].append(time.time() - start)
+    api.inject_faults()
+
+    results = {'upstream': api.count_requests(), 'retries': fsgo.retries_sent}
+    for name, call in calls:
+        results[name] = {
+            'latency': common.summarize(times[name]),
+            'errors': errors[name],
+            'error_rate': round(float(errors[name]) / args.repeat, 4)
+        }
+    return results
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--stall-rate', type=float, default=0.05, help='fraction of the requests that stall')
+    parser.add_argument('--stall', type=float, default=1.0, help='seconds a stalled request is answered late')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='fraction of the requests that fail')
+    parser.add_argument('--read-timeout', type=float, default=0.25, help='read timeout in seconds, when enabled')
+    parser.set_defaults(latency=0.02, repeat=200)
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    results = {}
+    try:
+        for mode in modes:
+            results[mode] = run_mode(args, api, profile, mode)
+    finally:
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
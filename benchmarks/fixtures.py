@@ -0,0 +1,108 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Synthetic FOX Sports GO API responses, shaped like the recorded ones and scalable to any number of events
+"""
+import time
+from datetime import datetime
+
+SPORTS = [
+    ('Soccer', ['Arsenal', 'Chelsea', 'Liverpool', 'Everton', 'LA Galaxy', 'Seattle Sounders']),
+    ('NFL', ['Packers', 'Bears', 'Cowboys', 'Giants', 'Seahawks', 'Rams']),
+    ('College Basketball', ['Duke', 'Villanova', 'Kansas', 'Gonzaga', 'Butler', 'Xavier']),
+    ('MLB', ['Yankees', 'Red Sox', 'Cubs', 'Dodgers', 'Astros', 'Mariners']),
+    ('NASCAR', ['Daytona 500', 'Talladega', 'Bristol', 'Martinsville', 'Watkins Glen', 'Phoenix'])
+]
+SHOWS = ['FOX Sports Live', 'Speak for Yourself', 'The Herd', 'UFC Tonight', 'NASCAR Race Hub']
+CHANNELS = [('fs1', 'FS1'), ('fs2', 'FS2'), ('btn', 'Big Ten Network'), ('fsdeportes', 'FOX Deportes'),
+            ('foxsoccerplus', 'FOX Soccer Plus')]
+IMAGE_SIZES = ['image_16x9_320', 'image_16x9_640', 'image_16x9_1280', 'image_16x9_1920', 'image_4x3_480']
+BITRATES = (800, 1800, 3000, 5000)  # Kbps of the variants in the master playlist
+EVENT_DURATION = 3 * 3600  # seconds
+
+
+def format_date(timestamp):
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def make_event(position, airing_time, now):
+    """Return one event. Every fifth one is a studio show without a sport tag and every seventh one a replay."""
+    channel_id, channel_name = CHANNELS[position % len(CHANNELS)]
+    if position % 5 == 4:
+        sport_tag = None
+        title = SHOWS[position % len(SHOWS)]
+    else:
+        sport_tag, teams = SPORTS[position % len(SPORTS)]
+        title = '%s vs. %s' % (teams[position % len(teams)], teams[(position // len(teams) + 1) % len(teams)])
+    airing_id = 'AIR%08d' % position
+    return {
+        'id': 'EVT%08d' % position,
+        'title': title,
+        'description': '%s live on %s. %s' % (title, channel_name, 'Pre-game coverage and analysis. ' * 4),
+        'sport_tag': sport_tag,
+        'genres': [sport_tag or 'Studio'],
+        'content_rating': 'TV-PG',
+        'urls': [{'size': size, 'src': 'https://images.example.com/%s/%s.jpg' % (airing_id, size)}
+                 for size in IMAGE_SIZES],
+        'airings': [{
+            'airing_id': airing_id,
+            'channel_id': channel_id,
+            'channel_name': channel_name,
+            'airing_date': format_date(airing_time),
+            'duration': EVENT_DURATION,
+            'is_live': airing_time <= now < airing_time + EVENT_DURATION,
+            'replay': position % 7 == 6,
+            'links': {'self': '/epg/ws/airing/%s' % airing_id}
+        }]
+    }
+
+
+def make_schedule(count, start=None, span=7 * 86400):
+    """Return count events airing at even intervals from start (default: two hours ago) until span seconds later."""
+    now = int(time.time())
+    start = int(start if start is not None else now - 7200)
+    return [make_event(position, start + position * span // max(count, 1), now) for position in xrange(count)]
+
+
+def make_schedule_response(events, offset=0):
+    return {'body': {'items': events, 'offset': offset, 'size': len(events)}, 'version': 1}
+
+
+def make_channels_response():
+    return {'body': {'items': [{'id': channel_id, 'name': channel_name,
+                                'urls': [{'size': 'logo_1x1_300', 'src': 'https://images.example.com/%s.png' % channel_id}]}
+                               for channel_id, channel_name in CHANNELS]}}
+
+
+def make_session(session_id='BENCHSESSION', lifetime=4 * 3600):
+    """Return a registered session expiring lifetime seconds from now."""
+    now = time.time()
+    return {
+        'id': session_id,
+        'expires_on': format_date(now + lifetime),
+        'user': {
+            'registration': {
+                'expires_on': format_date(now + 30 * 86400),
+                'auth_provider': 'Bench Cable',
+                'entitlements': ['fs1', 'fs2', 'btn', 'fsdeportes']
+            }
+        }
+    }
+
+
+def make_master_playlist():
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for bitrate in BITRATES:
+        lines.append('#EXT-X-STREAM-INF:BANDWIDTH=%d,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"'
+                     % (bitrate * 1000))
+        lines.append('%d/index.m3u8' % bitrate)
+    return '\n'.join(lines) + '\n'
+
+
+def make_variant_playlist(segment_count=10, segment_duration=6):
+    """Return a live variant playlist of segment_count segments."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:%d' % segment_duration,
+             '#EXT-X-MEDIA-SEQUENCE:0']
+    for position in xrange(segment_count):
+        lines.append('#EXTINF:%d.0,' % segment_duration)
+        lines.append('segment%d.ts' % position)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,42 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks rendering the listing of the busiest day of a large schedule
+
+Usage: python -m benchmarks.listing [--events N] [--latency SECONDS] [--repeat N] [--output FILE]
+
+The listing is rendered with the schedule cached and with reading a setting from Kodi costing nothing and 1 ms.
+As settings are read once per invocation (see AddonSettings in addon.py), the number of getSetting calls and the
+listing time don't grow with the number of events.
+"""
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.set_defaults(events=5000)
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    results = {}
+    try:
+        dates = common.get_fsgo(profile, api).get_schedule_index()['dates']
+        busiest_date = max(dates, key=lambda event_date: len(dates[event_date]))
+        paramstring = 'action=list_events_by_date&schedule_type=all&filter_date=%s' % busiest_date
+        common.run_plugin(profile, api, paramstring)  # fill the cache
+        for setting_cost in (0, 0.001):
+            runs = [common.run_plugin(profile, api, paramstring, setting_cost=setting_cost)
+                    for run in range(args.repeat)]
+            results['setting cost %s ms' % (setting_cost * 1000)] = {
+                'shown': common.summarize([run['shown'] for run in runs]),
+                'items': runs[-1]['items'],
+                'getSetting': runs[-1]['getSetting']
+            }
+    finally:
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Runs one plugin invocation outside Kodi, like Kodi does in a process of its own, and prints what it cost as JSON
+
+Usage: python -m benchmarks.plugin <profile folder> <API URL> [<paramstring> [<settings as JSON> [<seconds per
+getSetting call>]]]
+"""
+import os
+import sys
+import time
+import json
+
+
+def count_modules():
+    return len([module for module in sys.modules.values() if module is not None])
+
+
+def point_at(addon, api_url):
+    """Have the fsgolib instance of the add-on use the stand-in APIs. The instance is still created lazily."""
+    get_fsgo = addon.get_fsgo
+
+    def get_local_fsgo(settings):
+        fsgo = get_fsgo(settings)
+        fsgo.base_url = fsgo.reg_url = api_url
+        return fsgo
+
+    addon.get_fsgo = get_local_fsgo
+
+
+def main():
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    profile, api_url = sys.argv[1:3]
+    paramstring = sys.argv[3] if len(sys.argv) > 3 else ''
+    settings = json.loads(sys.argv[4]) if len(sys.argv) > 4 else {}
+    setting_cost = float(sys.argv[5]) if len(sys.argv) > 5 else 0
+
+    from benchmarks import xbmcstubs
+    xbmcstubs.install(profile, settings, setting_cost)
+    sys.argv = ['plugin://plugin.video.fsgo/', '1', '?' + paramstring]
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')  # fsgolib logs with print
+    modules_before = count_modules()
+    start = time.time()
+    import addon
+    imported = time.time()
+    point_at(addon, api_url)
+    try:
+        addon.run()
+    except SystemExit:
+        pass
+    end = time.time()
+    sys.stdout = stdout
+
+    handed_over = xbmcstubs.calls['handed_over']
+    print json.dumps({
+        'import': round(imported - start, 4),
+        'shown': round(handed_over - start, 4) if handed_over else None,  # until the result was handed to Kodi
+        'total': round(end - start, 4),
+        'modules': count_modules() - modules_before,
+        'modules_shown': handed_over and xbmcstubs.calls['handed_over_modules'] - modules_before,
+        'items': xbmcstubs.calls['items'],
+        'resolved': len(xbmcstubs.calls['resolved']),
+        'getSetting': xbmcstubs.calls['getSetting']
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Simulates hours of the background service's prefetch loop in seconds, with a fake clock and the stand-in API
+
+Usage: python -m benchmarks.prefetch [--events N] [--latency SECONDS] [--hours N] [--outage-hour N] [--output FILE]
+
+The loop runs like in service.py except that waiting advances a fake clock instead of sleeping. Video plays during
+the second hour, when the loop should back off, and the API answers every request with a 503 error during hour
+--outage-hour (counted from 0, default 2), which the loop should survive without multiplying its requests by
+retrying them however long it has been running. The upstream requests and the retries of every hour are reported.
+"""
+import os
+import time
+from datetime import datetime
+
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+from resources.lib import fsgo as fsgo_module
+from resources.lib.prefetcher import prefetcher
+
+endpoints = [('/sessions', 'session'), ('/epg/ws/live', 'live'), ('/epg/ws/featured', 'featured'),
+             ('/epg/ws/schedule', 'schedule'), ('/epg/ws/channel', 'channels')]
+
+
+class FakeClock(object):
+    def __init__(self, folder):
+        """A clock for fsgolib and the loop, advanced by wait() instead of sleeping. install() patches time.time()
+        and the datetime class used by fsgolib. The files written to folder in real time are stamped in fake time
+        after every tick, as their mtime is the time they were stored."""
+        self.folder = folder
+        self.offset = 0  # seconds waited
+        self.real_time = time.time
+        self.stamped = {}  # path: the mtime it was stamped with
+
+    def time(self):
+        return self.real_time() + self.offset
+
+    def install(self):
+        clock = self
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.fromtimestamp(clock.time(), tz)
+
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcfromtimestamp(clock.time())
+
+        time.time = self.time
+        fsgo_module.datetime = FakeDatetime
+
+    def uninstall(self):
+        time.time = self.real_time
+        fsgo_module.datetime = datetime
+
+    def wait(self, seconds):
+        self.stamp_files()
+        self.offset += seconds
+        return False
+
+    def stamp_files(self):
+        for folder, folder_names, filenames in os.walk(self.folder):
+            for filename in filenames:
+                path = os.path.join(folder, filename)
+                try:
+                    mtime = os.path.getmtime(path)
+                    if self.stamped.get(path) != mtime:
+                        os.utime(path, (mtime + self.offset, mtime + self.offset))
+                        self.stamped[path] = os.path.getmtime(path)
+                except OSError:
+                    pass
+
+
+class recorded_prefetcher(prefetcher):
+    def __init__(self, api, clock, hours, outage_hour, **kwargs):
+        """A prefetcher recording the upstream requests of every hour, which stops after the given hours."""
+        prefetcher.__init__(self, wait=self.wait_and_check, is_playing=self.is_video_playing, **kwargs)
+        self.api = api
+        self.clock = clock
+        self.hours = hours
+        self.start = clock.time()
+        self.timeline = [{'ticks': 0, 'playing': hour == 1, 'outage': hour == outage_hour, 'requests': {},
+                          'retries': 0} for hour in range(hours)]
+
+    def get_hour(self):
+        return int((self.clock.time() - self.start) // 3600)
+
+    def is_video_playing(self):
+        return self.get_hour() == 1
+
+    def wait_and_check(self, seconds):
+        self.clock.wait(seconds)
+        return self.get_hour() >= self.hours
+
+    def tick(self, prefetch=True):
+        hour = self.timeline[self.get_hour()]
+        self.api.error_status = 503 if hour['outage'] else None
+        requests_before = len(self.api.requests)
+        retries_before = self.fsgo.retries_sent
+        prefetcher.tick(self, prefetch)
+        hour['ticks'] += 1
+        hour['retries'] += self.fsgo.retries_sent - retries_before
+        for method, path in self.api.requests[requests_before:]:
+            endpoint = [name for prefix, name in endpoints if path.startswith(prefix)][0]
+            hour['requests'][endpoint] = hour['requests'].get(endpoint, 0) + 1
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--hours', type=int, default=6, help='hours to simulate, at least one past the outage hour')
+    parser.add_argument('--outage-hour', type=int, default=2, help='the hour the API fails, at least 2')
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    clock = FakeClock(profile)
+    clock.install()
+    try:
+        outage_hour = max(args.outage_hour, 2)
+        loop = recorded_prefetcher(api, clock, max(args.hours, outage_hour + 1), outage_hour,
+                                   fsgo=common.get_fsgo(profile, api))
+        start = clock.real_time()
+        loop.run()
+        results = {
+            'simulated_hours': loop.hours,
+            'real_seconds': round(clock.real_time() - start, 2),
+            'hours': loop.timeline
+        }
+    finally:
+        clock.uninstall()
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks playing HLS through the prefetching proxy against playing straight from a slow origin
+
+Usage: python -m benchmarks.proxy [--latency SECONDS] [--repeat N] [--segment-duration SECONDS]
+[--prefetch-count N] [--output FILE]
+
+The origin is the stand-in API's HLS endpoints, answering after --latency seconds. A simple player reads the master
+playlist, its first variant and then the variant's segments one after the other, playing each for
+--segment-duration seconds (sped up, the fixture's segments are 6 s long) before requesting the next, like a player
+with a one segment buffer. Every wait for a segment after the first one is a stall. Through the proxy, the segments
+after a requested one are downloaded while it plays. 'wait' summarizes the time waited per segment, 'stall' the
+total stall time and 'first_segment' the time until playback starts, per playback.
+"""
+import time
+from urlparse import urljoin
+
+import requests
+
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+from resources.lib.hlsproxy import hlsproxy
+
+
+def get_uris(http_session, playlist_url):
+    """Return the absolute URIs in a playlist."""
+    req = http_session.get(playlist_url)
+    req.raise_for_status()
+    return [urljoin(playlist_url, line.strip()) for line in req.content.splitlines()
+            if line.strip() and not line.startswith('#')]
+
+
+def play(master_url, segment_duration):
+    """Play a stream and return the time until the first segment arrived and the time waited for every segment."""
+    http_session = requests.Session()
+    start = time.time()
+    variant_url = get_uris(http_session, master_url)[0]
+    waits = []
+    first_segment = None
+    for segment_url in get_uris(http_session, variant_url):
+        request_time = time.time()
+        req = http_session.get(segment_url)
+        req.raise_for_status()
+        waits.append(time.time() - request_time)
+        if first_segment is None:
+            first_segment = time.time() - start
+        time.sleep(segment_duration)
+    return first_segment, waits
+
+
+def play_direct(api, args):
+    return play(api.url + '/hls/master.m3u8', args.segment_duration)
+
+
+def play_proxied(api, args):
+    proxy = hlsproxy(prefetch_count=args.prefetch_count)
+    proxy.start()
+    try:
+        return play(proxy.get_url(api.url + '/hls/master.m3u8'), args.segment_duration)
+    finally:
+        proxy.stop()
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--segment-duration', type=float, default=0.5, help='seconds each segment plays for')
+    parser.add_argument('--prefetch-count', type=int, default=3, help='segments the proxy downloads ahead')
+    parser.set_defaults(latency=0.3, repeat=3)
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    results = {}
+    try:
+        for name, play_stream in (('direct', play_direct), ('proxy', play_proxied)):
+            first_segments, waits, stalls = [], [], []
+            for run in range(args.repeat):
+                first_segment, segment_waits = play_stream(api, args)
+                first_segments.append(first_segment)
+                waits.extend(segment_waits)
+                stalls.append(sum(segment_waits[1:]))
+            results[name] = {
+                'first_segment': common.summarize(first_segments),
+                'wait': common.summarize(waits),
+                'stall': common.summarize(stalls)
+            }
+    finally:
+        api.stop()
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
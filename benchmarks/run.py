@@ -0,0 +1,87 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks fsgolib and the plugin's router actions against a local stand-in for the FOX Sports GO APIs
+
+Usage: python -m benchmarks.run [--events N] [--latency SECONDS] [--repeat N] [--output FILE]
+
+Every fsgolib call is measured with a cold cache (a new instance and an empty cache folder) and a warm one.
+Router actions run in a process of their own each, like Kodi runs them.
+"""
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+
+router_actions = [
+    ('main_menu', ''),
+    ('home', 'action=list_events&schedule_type=home'),
+    ('live', 'action=list_events&schedule_type=live'),
+    ('featured', 'action=list_events&schedule_type=featured'),
+    ('today', 'action=list_events_by_date&schedule_type=all&filter_date=today'),
+    ('upcoming_days', 'action=list_upcoming_days'),
+    ('search', 'action=search'),
+    ('play_channel', 'action=play_channel&channel_id=fs1'),
+    ('show_auth_details', 'action=show_auth_details')
+]
+
+
+fsgolib_calls = [
+    ('login', lambda fsgo: fsgo.login()),
+    ('get_schedule(live)', lambda fsgo: list(fsgo.get_schedule('live'))),
+    ('get_schedule(featured)', lambda fsgo: list(fsgo.get_schedule('featured'))),
+    ('get_schedule(search)', lambda fsgo: list(fsgo.get_schedule('search', search_query='soccer'))),
+    ('get_schedule(today)', lambda fsgo: fsgo.get_schedule('all', filter_date='today')),
+    ('get_event_dates', lambda fsgo: fsgo.get_event_dates()),
+    ('get_stream_url', lambda fsgo: fsgo.get_stream_url('fs1'))
+]
+
+
+def benchmark_fsgolib(args, api, profile):
+    results = {}
+    for name, call in fsgolib_calls:
+        for cache in ('cold', 'warm'):
+            times = []
+            for run in range(args.repeat):
+                common.clear_cache(profile)
+                if cache == 'warm':
+                    call(common.get_fsgo(profile, api))
+                fsgo = common.get_fsgo(profile, api)  # a new instance, like the next plugin process
+                times.append(common.timed(lambda: call(fsgo))[0])
+            results['%s %s' % (name, cache)] = common.summarize(times)
+    return results
+
+
+def benchmark_router(args, api, profile):
+    results = {}
+    for name, paramstring in router_actions:
+        for cache in ('cold', 'warm'):
+            runs = []
+            for run in range(args.repeat):
+                common.clear_cache(profile)
+                if cache == 'warm':
+                    common.run_plugin(profile, api, paramstring)
+                runs.append(common.run_plugin(profile, api, paramstring))
+            result = dict((key, common.summarize([run[key] for run in runs]))
+                          for key in ('wall', 'import', 'shown', 'total'))
+            result['modules_shown'] = runs[-1]['modules_shown']
+            result['modules'] = runs[-1]['modules']
+            result['items'] = runs[-1]['items']
+            results['%s %s' % (name, cache)] = result
+    return results
+
+
+def main():
+    args = common.get_parser(__doc__.strip().splitlines()[0]).parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    try:
+        results = {
+            'fsgolib': benchmark_fsgolib(args, api, profile),
+            'router': benchmark_router(args, api, profile)
+        }
+    finally:
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks building the local search index over a large schedule and answering queries from it
+
+Usage: python -m benchmarks.search [--events N] [--latency SECONDS] [--repeat N] [--output FILE]
+
+'index cold' fetches the upcoming schedule and builds the index (fsgolib.get_schedule_index()), 'index warm' reads it
+from the cache as the next plugin process does and 'build' is building it from parsed events alone. Every query is
+answered by fsgolib.search_schedule() from an index already loaded, 'server' is the first page of the same query
+from the stand-in API's search endpoint for comparison.
+"""
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+
+queries = ['soccer', 'ars', 'packers bears', 'fs1', 'big ten', 'race hub', 'nomatch']
+
+
+def benchmark_index(args, api, profile):
+    results = {}
+    for cache in ('cold', 'warm'):
+        times = []
+        for run in range(args.repeat):
+            common.clear_cache(profile)
+            if cache == 'warm':
+                common.get_fsgo(profile, api).get_schedule_index()
+            fsgo = common.get_fsgo(profile, api)
+            times.append(common.timed(fsgo.get_schedule_index)[0])
+        results['index %s' % cache] = common.summarize(times)
+
+    fsgo = common.get_fsgo(profile, api)
+    schedule_index = fsgo.get_schedule_index()
+    times = [common.timed(lambda: fsgo.build_schedule_index(schedule_index['events'], schedule_index['windows']))[0]
+             for run in range(args.repeat)]
+    results['build'] = common.summarize(times)
+    results['events'] = len(schedule_index['events'])
+    results['tokens'] = len(schedule_index['tokens'])
+    return results
+
+
+def benchmark_queries(args, api, profile):
+    fsgo = common.get_fsgo(profile, api)
+    fsgo.get_schedule_index()
+    results = {}
+    for query in queries:
+        for search_filter in (None, 'events'):
+            runs = [common.timed(lambda: fsgo.search_schedule(query, search_filter)) for run in range(args.repeat)]
+            server_times = []
+            for run in range(args.repeat):
+                common.clear_cache(profile)
+                server_times.append(common.timed(lambda: list(fsgo.get_schedule(
+                    'search', search_query=query, search_filter=search_filter)))[0])
+            results['%s (%s)' % (query, search_filter or 'all')] = {
+                'local': common.summarize([seconds for seconds, events in runs], 6),
+                'results': len(runs[-1][1]),
+                'server': common.summarize(server_times)
+            }
+    return results
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.set_defaults(events=5000)
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    try:
+        results = {
+            'index': benchmark_index(args, api, profile),
+            'queries': benchmark_queries(args, api, profile)
+        }
+    finally:
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks the start-up of every router action: the wall time of the plugin process and the modules it imports
+
+Usage: python -m benchmarks.startup [--events N] [--latency SECONDS] [--repeat N] [--output FILE]
+
+Responses are cached so that the time is spent in the add-on. 'shown' is the time from importing addon.py until the
+result is handed to Kodi and 'modules_shown' the number of modules imported by then, 'wall' and 'modules' cover the
+whole invocation, 'wall' including starting the interpreter.
+"""
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+from benchmarks.run import router_actions
+
+
+def main():
+    args = common.get_parser(__doc__.strip().splitlines()[0]).parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profile = common.make_profile(api)
+    results = {}
+    try:
+        for name, paramstring in router_actions:
+            common.run_plugin(profile, api, paramstring)  # fill the cache
+            runs = [common.run_plugin(profile, api, paramstring) for run in range(args.repeat)]
+            results[name] = {
+                'wall': common.summarize([run['wall'] for run in runs]),
+                'shown': common.summarize([run['shown'] for run in runs]),
+                'modules_shown': runs[-1]['modules_shown'],
+                'modules': runs[-1]['modules']
+            }
+    finally:
+        api.stop()
+        common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
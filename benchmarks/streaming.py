@@ -0,0 +1,124 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Benchmarks parsing a large schedule response incrementally against parsing it whole
+
+Usage: python -m benchmarks.streaming [--events N] [--latency SECONDS] [--repeat N] [--output FILE]
+
+'streamed' is get_schedule(), which yields events as fsgolib.iter_items() parses them from the response, 'whole' is
+json.loads() of the complete response followed by parsing every event. The events are counted and dropped, as a
+listing does once it has added them. Each run happens in a new process so that 'peak_memory' (the growth of the peak
+resident set size in kB) isn't skewed by earlier runs. 'first_event' is the time until the first event is available
+and 'total' until all of them are. 'cold' fetches the response from the stand-in API, 'warm' reads it from the cache,
+'upstream' counts the schedule requests of the measured run. Every benchmark runs with a quarter of --events too: the
+peak memory of 'streamed' should only grow by fsgolib's memo of parsed dates, that of 'whole' grows with the
+schedule. The default --events keeps the response within fsgolib's cache size limit.
+"""
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+from resources.lib.fsgo import fsgolib
+
+
+def parse_streamed(fsgo):
+    events = fsgo.get_schedule('all')
+    next(events)
+    first_event_time = time.time()
+    return first_event_time, 1 + sum(1 for event in events)
+
+
+def parse_whole(fsgo):
+    items = json.loads(fsgo.get_schedule_data('all'))['body']['items']
+    fsgo.parse_event(items[0])
+    first_event_time = time.time()
+    return first_event_time, 1 + sum(1 for item in items[1:] if fsgo.parse_event(item))
+
+
+parsers = {
+    'streamed': parse_streamed,
+    'whole': parse_whole
+}
+
+
+def get_peak_memory():
+    """Return the peak resident set size of this process in kB. On Linux the maximum in getrusage() includes the
+    parent's at the time it started this process, the high water mark in /proc doesn't."""
+    try:
+        with open('/proc/self/status') as fh_status:
+            for line in fh_status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(parser_name, profile, api_url):
+    """Parse the schedule in this process and print the measurements as JSON."""
+    fsgo = fsgolib(profile, base_url=api_url, reg_url=api_url)
+    fsgo.get_credentials()
+    import requests  # imported by the first request, its memory isn't part of parsing
+    memory_before = get_peak_memory()
+    start = time.time()
+    first_event_time, event_count = parsers[parser_name](fsgo)
+    end = time.time()
+    print json.dumps({
+        'first_event': first_event_time - start,
+        'total': end - start,
+        'peak_memory': get_peak_memory() - memory_before,
+        'events': event_count
+    })
+
+
+def run_measure(parser_name, profile, api):
+    api.reset_requests()
+    output = subprocess.check_output([sys.executable, '-m', 'benchmarks.streaming', '--measure', parser_name,
+                                      '--profile', profile, '--api-url', api.url], cwd=common.repo_path)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['upstream'] = api.count_requests('/epg/')
+    return result
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--measure', choices=sorted(parsers), help=argparse.SUPPRESS)
+    parser.add_argument('--profile', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    parser.set_defaults(events=4000)  # about 4 MB
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure, args.profile, args.api_url)
+        return
+
+    results = {}
+    for event_count in (args.events // 4, args.events):
+        api = fakeapi(event_count=event_count, latency=args.latency).start()
+        profile = common.make_profile(api)
+        try:
+            for parser_name in sorted(parsers):
+                for cache in ('cold', 'warm'):
+                    runs = []
+                    for run in range(args.repeat):
+                        common.clear_cache(profile)
+                        if cache == 'warm':
+                            run_measure(parser_name, profile, api)
+                        runs.append(run_measure(parser_name, profile, api))
+                    result = dict((key, common.summarize([run[key] for run in runs]))
+                                  for key in ('first_event', 'total'))
+                    for key in ('peak_memory', 'upstream'):
+                        result[key] = common.summarize([run[key] for run in runs], 0)
+                    result['events'] = runs[-1]['events']
+                    results['%s %s %s' % (parser_name, cache, event_count)] = result
+        finally:
+            api.stop()
+            common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
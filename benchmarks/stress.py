@@ -0,0 +1,97 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Stress-tests fsgolib from many threads on two account profiles sharing one connection pool
+
+Usage: python -m benchmarks.stress [--events N] [--latency SECONDS] [--repeat N] [--threads N] [--output FILE]
+
+Every thread makes --repeat rounds of get_schedule() and get_stream_url() calls on one of two profiles with the cache
+TTLs at 0, so that every call goes to the stand-in API. In 'own instances' every thread creates its own fsgolib
+instance for each call, like a request handler would, in 'shared instance' the threads of a profile share one.
+Failed calls are counted in 'errors', with the first few messages in 'error_messages'.
+"""
+import time
+import threading
+
+import requests
+
+from benchmarks import common
+from benchmarks.fakeapi import fakeapi
+
+calls = [
+    ('get_schedule(live)', lambda fsgo: list(fsgo.get_schedule('live'))),
+    ('get_schedule(featured)', lambda fsgo: list(fsgo.get_schedule('featured'))),
+    ('get_stream_url', lambda fsgo: fsgo.get_stream_url('fs1'))
+]
+
+
+def get_uncached_fsgo(profile, api, http_adapter):
+    fsgo = common.get_fsgo(profile, api, http_adapter=http_adapter)
+    fsgo.cache_ttls = dict.fromkeys(fsgo.cache_ttls, 0)
+    fsgo.stream_ttl = 0
+    return fsgo
+
+
+def run_threads(args, api, profiles, shared):
+    """Run the calls from args.threads threads and return the results."""
+    http_adapter = requests.adapters.HTTPAdapter(pool_maxsize=10)
+    instances = dict((profile, get_uncached_fsgo(profile, api, http_adapter)) for profile in profiles)
+    times = dict((name, []) for name, call in calls)
+    errors = []
+    lock = threading.Lock()
+
+    def worker(thread_number):
+        profile = profiles[thread_number % len(profiles)]
+        for run in range(args.repeat):
+            for name, call in calls:
+                fsgo = instances[profile] if shared else get_uncached_fsgo(profile, api, http_adapter)
+                start = time.time()
+                try:
+                    call(fsgo)
+                except Exception as error:  # any failure counts, the test is about thread safety
+                    with lock:
+                        errors.append('%s: %s: %r' % (name, type(error).__name__, error))
+                    continue
+                with lock:
+                    times[name].append(time.time() - start)
+
+    api.reset_requests()
+    threads = [threading.Thread(target=worker, args=(thread_number,)) for thread_number in range(args.threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    completed = sum(len(call_times) for call_times in times.values())
+    results = dict((name, common.summarize(call_times)) for name, call_times in times.items())
+    results.update({
+        'calls': completed + len(errors),
+        'errors': len(errors),
+        'error_messages': errors[:5],
+        'calls_per_second': round(completed / seconds, 1),
+        'upstream': api.count_requests(),
+        'logged_in': [get_uncached_fsgo(profile, api, http_adapter).valid_session() for profile in profiles]
+    })
+    return results
+
+
+def main():
+    parser = common.get_parser(__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32, help='threads calling fsgolib at once')
+    args = parser.parse_args()
+    api = fakeapi(event_count=args.events, latency=args.latency).start()
+    profiles = [common.make_profile(api), common.make_profile(api)]
+    results = {'threads': args.threads}
+    try:
+        for mode, shared in (('own instances', False), ('shared instance', True)):
+            results[mode] = run_threads(args, api, profiles, shared)
+    finally:
+        api.stop()
+        for profile in profiles:
+            common.remove_profile(profile)
+    common.write_results(args, results)
+
+
+if __name__ == '__main__':
+    main()
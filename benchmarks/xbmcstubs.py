@@ -0,0 +1,174 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Stand-ins for the xbmc, xbmcaddon, xbmcgui, xbmcplugin and xbmcvfs modules so that addon.py runs outside Kodi
+
+install() puts them in sys.modules. What the add-on hands to Kodi is recorded in the calls dict.
+"""
+import os
+import sys
+import time
+import types
+import xml.etree.ElementTree as ElementTree
+
+addon_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+calls = {
+    'getSetting': 0,
+    'items': 0,  # directory items added
+    'resolved': [],  # URLs passed to setResolvedUrl
+    'handed_over': None,  # time.time() of the first endOfDirectory or setResolvedUrl call
+    'handed_over_modules': None  # the number of modules imported by then
+}
+state = {
+    'profile': None,
+    'settings': {},
+    'setting_cost': 0,  # seconds every getSetting call takes, reading a setting from Kodi isn't free
+    'keyboard_text': 'soccer',
+    'select': 0,  # the option picked in select dialogs
+    'yesno': False
+}
+
+
+def get_default_settings():
+    """Return the default value of every setting in resources/settings.xml."""
+    tree = ElementTree.parse(os.path.join(addon_path, 'resources', 'settings.xml'))
+    return dict((setting.get('id'), setting.get('default', '')) for setting in tree.iter('setting')
+                if setting.get('id'))
+
+
+def handed_over():
+    if calls['handed_over'] is None:
+        calls['handed_over'] = time.time()
+        calls['handed_over_modules'] = len([module for module in sys.modules.values() if module is not None])
+
+
+class Addon(object):
+    def __init__(self, id=None):
+        pass
+
+    def getSetting(self, setting_id):
+        calls['getSetting'] += 1
+        if state['setting_cost']:
+            time.sleep(state['setting_cost'])
+        return state['settings'].get(setting_id, '')
+
+    def getAddonInfo(self, info_id):
+        return {
+            'id': 'plugin.video.fsgo',
+            'version': 'bench',
+            'path': addon_path,
+            'profile': state['profile'],
+            'icon': os.path.join(addon_path, 'resources', 'art', 'icon.png'),
+            'fanart': os.path.join(addon_path, 'resources', 'art', 'fanart.jpg')
+        }[info_id]
+
+    def getLocalizedString(self, string_id):
+        return u'#%s' % string_id
+
+
+class ListItem(object):
+    def __init__(self, label='', label2='', iconImage='', thumbnailImage='', path=''):
+        self.label = label
+        self.path = path
+
+    def setProperty(self, key, value):
+        pass
+
+    def setArt(self, art):
+        pass
+
+    def setInfo(self, info_type, info_labels):
+        pass
+
+    def addStreamInfo(self, stream_type, stream_values):
+        pass
+
+    def addContextMenuItems(self, items, replaceItems=False):
+        pass
+
+    def setContentLookup(self, enable):
+        pass
+
+
+class Dialog(object):
+    def ok(self, heading, line1='', line2='', line3=''):
+        return True
+
+    def yesno(self, heading, line1='', line2='', line3='', nolabel='', yeslabel='', autoclose=0):
+        return state['yesno']
+
+    def select(self, heading, options, autoclose=0):
+        return state['select']
+
+
+class Keyboard(object):
+    def __init__(self, default='', heading='', hidden=False):
+        pass
+
+    def doModal(self, autoclose=0):
+        pass
+
+    def isConfirmed(self):
+        return True
+
+    def getText(self):
+        return state['keyboard_text']
+
+
+class Player(object):
+    def isPlaying(self):
+        return False
+
+    def isPlayingVideo(self):
+        return False
+
+    def getPlayingFile(self):
+        raise RuntimeError('Kodi is not playing any file')
+
+
+class Monitor(object):
+    def abortRequested(self):
+        return True
+
+    def waitForAbort(self, timeout=None):
+        return True
+
+
+def add_directory_item(handle, url, listitem, isFolder=False, totalItems=0):
+    calls['items'] += 1
+    return True
+
+
+def add_directory_items(handle, items, totalItems=0):
+    calls['items'] += len(items)
+    return True
+
+
+def set_resolved_url(handle, succeeded, listitem):
+    calls['resolved'].append(listitem.path)
+    handed_over()
+
+
+def make_module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install(profile, settings=None, setting_cost=0):
+    """Put the stub modules in sys.modules. profile is the add-on's profile folder, settings override the defaults
+    from resources/settings.xml and every getSetting call takes setting_cost seconds."""
+    state['profile'] = profile
+    state['setting_cost'] = setting_cost
+    state['settings'] = get_default_settings()
+    state['settings'].update(settings or {})
+    sys.modules['xbmc'] = make_module(
+        'xbmc', LOGDEBUG=0, LOGNOTICE=2, LOGERROR=4, log=lambda msg, level=0: None,
+        translatePath=lambda path: path, executeJSONRPC=lambda command: '{"id": "1", "result": "OK"}',
+        Keyboard=Keyboard, Player=Player, Monitor=Monitor)
+    sys.modules['xbmcaddon'] = make_module('xbmcaddon', Addon=Addon)
+    sys.modules['xbmcgui'] = make_module('xbmcgui', ListItem=ListItem, Dialog=Dialog)
+    sys.modules['xbmcplugin'] = make_module(
+        'xbmcplugin', addDirectoryItem=add_directory_item, addDirectoryItems=add_directory_items,
+        endOfDirectory=lambda handle, succeeded=True, updateListing=False, cacheToDisc=True: handed_over(),
+        setResolvedUrl=set_resolved_url, setContent=lambda handle, content: None)
+    sys.modules['xbmcvfs'] = make_module('xbmcvfs', exists=os.path.exists, mkdir=os.makedirs)
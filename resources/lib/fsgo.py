@@ -3,35 +3,218 @@
 A Kodi-agnostic library for FOX Sports GO
 """
 import os
+import sys
 import json
 import codecs
 import cookielib
 import time
 import calendar
 import uuid
+import hashlib
+import re
+import errno
+import bisect
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
 from urllib import urlencode
-from datetime import datetime, timedelta
+from urlparse import urljoin, urlparse, parse_qsl
+from datetime import datetime, timedelta, tzinfo
 
-import requests
-import m3u8
-import iso8601
+# requests, m3u8 and iso8601 are imported where they're used as they're slow to import
+# and not needed by e.g. valid_session()
+
+
+# the timestamp format used by the API, e.g. 2017-02-14T19:00:00Z or 2017-02-14T19:00:00.000+00:00
+ISO8601_UTC_REGEX = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?(?:Z|[+-]00:?00)?$')
+# expiry tokens used by CDNs in signed URLs, e.g. exp=1487098800 or hdnts=exp=1487098800~acl=...
+STREAM_EXPIRY_REGEX = re.compile(r'\bexp(?:ires)?=(\d{10})\b')
+
+JSON_ITEMS_REGEX = re.compile(r'"items"\s*:\s*\[')
+# the words searches are matched against
+SEARCH_TOKEN_REGEX = re.compile(r'\w+', re.UNICODE)
+
+
+class UTC(tzinfo):
+    def utcoffset(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return 'UTC'
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+# one shared instance, datetimes with the same tzinfo object are compared without calling utcoffset()
+UTC_TZINFO = UTC()
+
+class CookieJar(cookielib.LWPCookieJar):
+    """An LWPCookieJar that keeps track of whether its cookies changed since they were loaded or saved."""
+    def __init__(self, filename=None, delayload=False, policy=None):
+        cookielib.LWPCookieJar.__init__(self, filename, delayload, policy)
+        self.changed = False
+
+    def set_cookie(self, cookie):
+        with self._cookies_lock:
+            try:
+                current_cookie = self._cookies[cookie.domain][cookie.path][cookie.name]
+                if current_cookie.value != cookie.value or current_cookie.expires != cookie.expires:
+                    self.changed = True
+            except KeyError:
+                self.changed = True
+            cookielib.LWPCookieJar.set_cookie(self, cookie)
+
+    def clear(self, domain=None, path=None, name=None):
+        cookielib.LWPCookieJar.clear(self, domain, path, name)
+        self.changed = True
+
+    def load(self, filename=None, ignore_discard=False, ignore_expires=False):
+        cookielib.LWPCookieJar.load(self, filename, ignore_discard, ignore_expires)
+        self.changed = False
+
+    def save(self, filename=None, ignore_discard=False, ignore_expires=False):
+        with self._cookies_lock:  # cookies set by other threads while saving would break the iteration
+            cookielib.LWPCookieJar.save(self, filename, ignore_discard, ignore_expires)
+            self.changed = False
+
+
+class Profile(object):
+    """The state shared by every fsgolib instance using the same settings folder within a process:
+    the lock guarding it, the credentials (None until read from the credentials file) and the cookie jar."""
+    __slots__ = ('lock', 'credentials', 'cookie_jar', 'cookies_loaded')
+
+    def __init__(self, settings_folder):
+        self.lock = threading.RLock()
+        self.credentials = None
+        self.cookie_jar = CookieJar(os.path.join(settings_folder, 'cookie_file'))
+        self.cookies_loaded = False
+
+
+# settings folder: Profile, see get_profile()
+profiles = {}
+profiles_lock = threading.Lock()
+
+
+def get_profile(settings_folder):
+    """Return the state shared by the fsgolib instances using a settings folder within this process."""
+    settings_folder = os.path.abspath(settings_folder)
+    with profiles_lock:
+        if settings_folder not in profiles:
+            profiles[settings_folder] = Profile(settings_folder)
+        return profiles[settings_folder]
+
+
+class Airing(object):
+    """The airing of an event shown in the add-on. airing_date is a UTC datetime."""
+    __slots__ = ('channel_id', 'airing_id', 'channel_name', 'airing_date', 'is_live', 'replay')
+
+    def __init__(self, channel_id, airing_id, channel_name, airing_date, is_live, replay):
+        self.channel_id = channel_id
+        self.airing_id = airing_id
+        self.channel_name = channel_name
+        self.airing_date = airing_date
+        self.is_live = is_live
+        self.replay = replay
+
+
+class Event(object):
+    """An event holding only the fields the add-on uses. image is the URL of the highest resolution image or None."""
+    __slots__ = ('title', 'sport_tag', 'image', 'airing')
+    fields = __slots__[:-1] + Airing.__slots__  # the layout of to_list(), stored along with serialized events
+
+    def __init__(self, title, sport_tag, image, airing):
+        self.title = title
+        self.sport_tag = sport_tag
+        self.image = image
+        self.airing = airing
+
+    def to_list(self):
+        """Return the event as a flat JSON serializable list."""
+        airing = self.airing
+        return [self.title, self.sport_tag, self.image, airing.channel_id, airing.airing_id, airing.channel_name,
+                calendar.timegm(airing.airing_date.utctimetuple()), airing.is_live, airing.replay]
+
+    @classmethod
+    def from_list(cls, values):
+        title, sport_tag, image, channel_id, airing_id, channel_name, timestamp, is_live, replay = values
+        airing_date = datetime.fromtimestamp(timestamp, UTC_TZINFO)
+        return cls(title, sport_tag, image, Airing(channel_id, airing_id, channel_name, airing_date, is_live, replay))
+
+
+class Channel(object):
+    __slots__ = ('channel_id', 'channel_name', 'image')
+
+    def __init__(self, channel_id, channel_name, image):
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.image = image
 
 
 class fsgolib(object):
-    def __init__(self, settings_folder, debug=False, verify_ssl=True):
+    def __init__(self, settings_folder, debug=False, verify_ssl=True, log_bodies=False, log_requests=False,
+                 base_url='https://media-api.foxsportsgo.com', reg_url='https://activation-adobe.foxsportsgo.com',
+                 hedging=False, http_adapter=None):
+        """With debug, requests are logged by URL and status only unless log_bodies is also set.
+        Every request is recorded in self.request_log, see add_request_record(), and with log_requests
+        the records are also written to the requests.jsonl file in settings_folder by save_request_log().
+        base_url and reg_url point the library at the media API and the activation service, e.g. a local
+        stand-in serving recorded responses. With hedging, slow schedule and stream requests are sent
+        a second time, see send_hedged().
+        An instance can be used from several threads. Instances for the same settings folder share its credentials
+        and cookies, see get_profile(). Instances for different settings folders (accounts) are independent and
+        can share the connection pool of one requests HTTPAdapter passed as http_adapter."""
         self.debug = debug
+        self.log_bodies = log_bodies
         self.verify_ssl = verify_ssl
-        self.http_session = requests.Session()
+        self.hedging = hedging
+        self._http_session = None  # created on first use, see http_session
+        self.http_adapter = http_adapter
+        self.pool_size = 10  # connections kept alive per host when the adapter is created here
         self.settings_folder = settings_folder
-        self.cookie_jar = cookielib.LWPCookieJar(os.path.join(self.settings_folder, 'cookie_file'))
+        self.profile = get_profile(settings_folder)  # credentials and cookies shared with other instances
+        self.lock = self.profile.lock
+        self.cookie_jar = self.profile.cookie_jar
         self.credentials_file = os.path.join(settings_folder, 'credentials')
-        self.base_url = 'https://media-api.foxsportsgo.com'
-        self.reg_url = 'https://activation-adobe.foxsportsgo.com'
-        try:
-            self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
-        except IOError:
-            pass
-        self.http_session.cookies = self.cookie_jar
+        self.schedule_index = None
+        self.parsed_datetimes = {}  # (iso8601_string, localize): datetime_obj
+        self.utc_offsets = {}  # hours since epoch: local UTC offset
+        self.memo_size_limit = 10000  # entries, parsed_datetimes and utc_offsets are cleared when they get larger
+        self.base_url = base_url
+        self.reg_url = reg_url
+        self.cache_folder = os.path.join(settings_folder, 'cache')
+        self.cache_size_limit = 5 * 1024 * 1024  # bytes
+        self.cache_ttls = {  # seconds
+            'live': 60,
+            'featured': 300,
+            'search': 300,
+            'schedule': 600,
+            'channels': 86400
+        }
+        self.stream_ttl = 300  # seconds, for stream URLs without an expiry token
+        self.throughput_ttl = 600  # seconds a throughput measurement is trusted
+        self.session_refresh_margin = timedelta(minutes=15)  # see keep_alive()
+        self.lock_timeout = 30  # seconds, see single_flight()
+        self.chunk_size = 64 * 1024  # bytes, for streamed responses
+        self.page_size = 50  # events per page of the featured and search listings
+        self.schedule_window = 86400  # seconds of upcoming schedule refreshed every schedule cache period
+        self.schedule_ahead_ttl = 3600  # seconds the schedule after that window is trusted, see get_stale_windows()
+        self.request_log = deque(maxlen=200)  # the most recent request records
+        self.unsaved_requests = 0  # records in self.request_log not written to self.request_log_file yet
+        self.request_log_file = os.path.join(settings_folder, 'requests.jsonl') if log_requests else None
+        self.request_log_size_limit = 1024 * 1024  # bytes, the file is rotated to requests.jsonl.old after that
+        self.timeouts = {  # endpoint: (connect, read) timeouts in seconds, the read timeout applies to every read
+            'default': (5, 15),
+            'schedule': (5, 30)
+        }
+        self.max_retries = 2  # per GET request, see may_retry()
+        self.retry_budget = (3, 0.1)  # retry tokens: at most 3 are saved up, every request sent earns 0.1
+        self.retry_tokens = self.retry_budget[0]
+        self.requests_sent = 0
+        self.retries_sent = 0
+        self.hedged_endpoints = ('live', 'featured', 'search', 'schedule', 'stream')
+        self.hedge_delay = 1.0  # seconds, until enough requests have been made to know the 95th percentile
 
     class LoginFailure(Exception):
         def __init__(self, value):
@@ -52,33 +235,584 @@ class fsgolib(object):
             except:
                 pass
 
-    def make_request(self, url, method, payload=None, headers=None, return_req=False):
-        """Make an HTTP request. Return the response."""
-        self.log('Request URL: %s' % url)
-        self.log('Method: %s' % method)
-        self.log('Payload: %s' % payload)
-        self.log('Headers: %s' % headers)
-        try:
-            if method == 'get':
-                req = self.http_session.get(url, params=payload, headers=headers, allow_redirects=False, verify=self.verify_ssl)
-            elif method == 'put':
-                req = self.http_session.put(url, params=payload, headers=headers, allow_redirects=False, verify=self.verify_ssl)
-            else:  # post
-                req = self.http_session.post(url, data=payload, headers=headers, allow_redirects=False, verify=self.verify_ssl)
-            self.log('Response code: %s' % req.status_code)
-            self.log('Response: %s' % req.content)
-            self.cookie_jar.save(ignore_discard=True, ignore_expires=False)
+    @property
+    def credentials(self):
+        """The credentials of the settings folder, loaded from self.credentials_file on first use."""
+        return self.profile.credentials
+
+    @credentials.setter
+    def credentials(self, credentials):
+        self.profile.credentials = credentials
+
+    @property
+    def http_session(self):
+        """The requests session. The cookie jar is loaded when the first session of the settings folder is used."""
+        with self.lock:
+            if self._http_session is None:
+                import requests
+                if self.http_adapter is None:
+                    # retries are done by send_request(), connections beyond pool_size are closed after use
+                    self.http_adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size)
+                http_session = requests.Session()
+                http_session.mount('https://', self.http_adapter)
+                http_session.mount('http://', self.http_adapter)
+                if not self.profile.cookies_loaded:
+                    try:
+                        self.cookie_jar.load(ignore_discard=True, ignore_expires=True)
+                    except IOError:
+                        pass
+                    self.profile.cookies_loaded = True
+                http_session.cookies = self.cookie_jar
+                self._http_session = http_session
+            return self._http_session
+
+    def make_request(self, url, method, payload=None, headers=None, return_req=False, cache_name=None, stream=False,
+                     endpoint=None):
+        """Make an HTTP request. Return the response.
+        GET requests with a cache_name are answered from the on-disk cache while they're
+        younger than the TTL in self.cache_ttls and revalidated through ETag/Last-Modified after that.
+        Only one process fetches a given cached response at a time, the others wait and reuse its result.
+        With stream=True an iterator over chunks of the response body is returned instead.
+        The endpoint name (the cache_name or URL path by default) selects the timeouts and whether the
+        request is hedged, see send_request()."""
+        self.log('%s %s' % (method.upper(), url))
+        if self.log_bodies:
+            self.log('Payload: %s' % payload)
+            self.log('Headers: %s' % headers)
+        record = {
+            'time': time.time(),
+            'endpoint': endpoint or cache_name or urlparse(url).path,
+            'method': method,
+            'cache': None,  # 'hit', 'revalidated' or 'miss' for cached requests
+            'status': None,
+            'ttfb': None
+        }
+        if not cache_name:
+            req = self.send_request(url, method, payload, headers, stream=stream, record=record)
+            if stream:
+                return self.record_chunks(req.iter_content(self.chunk_size), record)
+            self.add_request_record(record, len(req.content))
             if return_req:
                 return req
             else:
                 return req.content
-        except requests.exceptions.ConnectionError as error:
-            self.log('Connection Error: - %s' % error.message)
-            raise
-        except requests.exceptions.RequestException as error:
-            self.log('Error: - %s' % error.value)
+
+        cache_key = self.get_cache_key(url, payload, headers)
+        cache_meta, fh_cache = self.open_cache(cache_key)
+        if cache_meta and time.time() - cache_meta['stored'] < self.cache_ttls[cache_name]:
+            self.log('Cache hit (%s).' % cache_name)
+            record['cache'] = 'hit'
+            chunks = self.iter_file(fh_cache)
+        else:
+            if fh_cache:
+                fh_cache.close()
+            chunks = self.fetch_cached(url, method, payload, headers, cache_name, cache_key, record)
+        chunks = self.record_chunks(chunks, record)
+        if stream:
+            return chunks
+        else:
+            return ''.join(chunks)
+
+    def fetch_cached(self, url, method, payload, headers, cache_name, cache_key, record):
+        """Fetch a response that isn't fresh in the cache and return an iterator over the chunks of its body.
+        The response is downloaded into the cache while holding the in-flight marker and read back from the cache
+        after releasing it, so that a consumer that reads slowly or stops early doesn't hold up other processes.
+        Error responses and responses announced to be larger than self.cache_size_limit aren't cached and are
+        streamed as they arrive."""
+        with self.single_flight(cache_key) as waited:
+            cache_meta, fh_cache = self.open_cache(cache_key)
+            if waited and cache_meta and time.time() - cache_meta['stored'] < self.cache_ttls[cache_name]:
+                # another process fetched the response while we were waiting
+                self.log('Cache hit after waiting for another process (%s).' % cache_name)
+                record['cache'] = 'hit'
+                return self.iter_file(fh_cache)
+            if cache_meta:
+                headers = dict(headers or {})
+                if cache_meta.get('etag'):
+                    headers['If-None-Match'] = cache_meta['etag']
+                if cache_meta.get('last_modified'):
+                    headers['If-Modified-Since'] = cache_meta['last_modified']
+
+            req = self.send_request(url, method, payload, headers, stream=True, record=record)
+            if req.status_code == 304 and cache_meta:
+                self.log('Cache revalidated (%s).' % cache_name)
+                record['cache'] = 'revalidated'
+                req.close()
+                self.touch_cache(cache_key)
+                return self.iter_file(fh_cache)
+            if fh_cache:
+                fh_cache.close()
+
+            record['cache'] = 'miss'
+            if req.status_code != 200:
+                return req.iter_content(self.chunk_size)
+            if int(req.headers.get('Content-Length') or 0) > self.cache_size_limit:
+                self.log('Not caching %s bytes, the cache is limited to %s.' % (req.headers['Content-Length'],
+                                                                              self.cache_size_limit))
+                self.remove_cache(cache_key)
+                return req.iter_content(self.chunk_size)
+            return self.download_cache(cache_key, req)
+
+    def download_cache(self, cache_key, req):
+        """Write a response to the cache as it arrives and return an iterator reading its body back from the cache.
+        Only a chunk at a time is held in memory. A response that turns out to be larger than self.cache_size_limit
+        is read back from the temporary file, which is removed afterwards."""
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        cache_file = os.path.join(self.cache_folder, cache_key)
+        temp_path = '%s.%s.tmp' % (cache_file, uuid.uuid4().hex)
+        cache_meta = {
+            'etag': req.headers.get('ETag'),
+            'last_modified': req.headers.get('Last-Modified')
+        }
+        size = 0
+        try:
+            with open(temp_path, 'wb') as fh_temp:
+                fh_temp.write(json.dumps(cache_meta) + '\n')
+                for chunk in req.iter_content(self.chunk_size):
+                    fh_temp.write(chunk)
+                    size += len(chunk)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             raise
 
+        if size > self.cache_size_limit:
+            self.log('Not caching %s bytes, the cache is limited to %s.' % (size, self.cache_size_limit))
+            self.remove_cache(cache_key)
+            fh_temp = open(temp_path, 'rb')
+            fh_temp.readline()
+            return self.iter_file(fh_temp, remove=True)
+        self.replace_file(temp_path, cache_file)
+        self.evict_cache(keep=cache_key)
+        return self.iter_file(self.open_cache(cache_key)[1])
+
+    def iter_file(self, fh_file, remove=False):
+        """Yield the rest of an open file in chunks and close it, then remove it if remove is set."""
+        try:
+            while True:
+                chunk = fh_file.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            fh_file.close()
+            if remove:
+                try:
+                    os.remove(fh_file.name)
+                except OSError:
+                    pass
+
+    def record_chunks(self, chunks, record):
+        """Pass chunks through and record the request once the last one has been read."""
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+        self.add_request_record(record, size)
+
+    def add_request_record(self, record, size):
+        """Complete a request record with the body size and the total time and add it to self.request_log.
+        A record holds the time the request was made, the endpoint (the cache name or the URL path),
+        the method, the cache status, the HTTP status, the time to the response headers (ttfb), the total time
+        and the size of the body in bytes. DNS and connect times aren't available from requests."""
+        record['bytes'] = size
+        record['total'] = round(time.time() - record['time'], 4)
+        with self.lock:
+            self.request_log.append(record)
+            self.unsaved_requests = min(self.unsaved_requests + 1, self.request_log.maxlen)
+
+    def save_request_log(self):
+        """Append the records added since the last call to self.request_log_file as JSON lines, if enabled."""
+        if not self.request_log_file:
+            return
+        with self.lock:
+            if not self.unsaved_requests:
+                return
+            records = list(self.request_log)[-self.unsaved_requests:]
+            self.unsaved_requests = 0
+            try:
+                if os.path.getsize(self.request_log_file) > self.request_log_size_limit:
+                    self.replace_file(self.request_log_file, self.request_log_file + '.old')
+            except OSError:
+                pass
+            with open(self.request_log_file, 'a') as fh_log:
+                fh_log.write(''.join(json.dumps(record) + '\n' for record in records))
+
+    def iter_items(self, chunks):
+        """Parse body.items of a JSON response incrementally and yield the items one by one.
+        Only the item being parsed and the unparsed part of the current chunk are held in memory."""
+        decoder = json.JSONDecoder()
+        chunks = iter(chunks)
+        buffer = ''
+        for chunk in chunks:
+            buffer += chunk
+            match = JSON_ITEMS_REGEX.search(buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            buffer = buffer[-64:]  # keep enough to find the key when it's split between chunks
+        else:
+            return
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                if buffer[position] == ']':
+                    for chunk in chunks:  # read the rest so that the response gets cached
+                        pass
+                    return
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                    yield item
+                    continue
+                except ValueError:  # the item continues in the next chunk
+                    pass
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError('Unexpected end of JSON response.')
+            buffer = buffer[position:] + chunk
+            position = 0
+
+    def send_request(self, url, method, payload=None, headers=None, stream=False, record=None):
+        """Send a request. The status and the time to the response headers are filled in the given request record,
+        which is added to the request log right away if the request fails.
+        Each request times out after the (connect, read) timeouts of its endpoint in self.timeouts.
+        GET requests failing with a connection error, a timeout or a 5xx status are retried as long as
+        may_retry() allows it and are hedged (see send_hedged()) if their endpoint is in self.hedged_endpoints."""
+        import requests
+        endpoint = record['endpoint'] if record else None
+        timeout = self.timeouts.get(endpoint, self.timeouts['default'])
+        if method == 'get':
+            send = lambda: self.http_session.get(url, params=payload, headers=headers, allow_redirects=False,
+                                                 verify=self.verify_ssl, stream=stream, timeout=timeout)
+        elif method == 'put':
+            send = lambda: self.http_session.put(url, params=payload, headers=headers, allow_redirects=False,
+                                                 verify=self.verify_ssl, stream=stream, timeout=timeout)
+        else:  # post
+            send = lambda: self.http_session.post(url, data=payload, headers=headers, allow_redirects=False,
+                                                  verify=self.verify_ssl, stream=stream, timeout=timeout)
+        hedge = self.hedging and method == 'get' and endpoint in self.hedged_endpoints
+
+        attempt = 0
+        while True:
+            try:
+                if hedge:
+                    req, hedged = self.send_hedged(send, self.get_hedge_delay(endpoint))
+                    if hedged and record is not None:
+                        record['hedged'] = True
+                else:
+                    self.count_request()
+                    req = send()
+                self.log('Response code: %s' % req.status_code)
+                if req.status_code >= 500 and method == 'get' and self.may_retry(attempt):
+                    req.close()
+                    attempt = self.retry(attempt, record)
+                    continue
+                if self.log_bodies and not stream:
+                    self.log('Response: %s' % req.content)
+                if record is not None:
+                    record['status'] = req.status_code
+                    record['ttfb'] = round(req.elapsed.total_seconds(), 4)
+                return req
+            except requests.exceptions.RequestException as error:
+                if isinstance(error, requests.exceptions.ConnectionError):
+                    self.log('Connection Error: - %s' % error.message)
+                else:
+                    self.log('Error: - %s' % error)
+                if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)) and \
+                        method == 'get' and self.may_retry(attempt):
+                    attempt = self.retry(attempt, record)
+                    continue
+                if record is not None:
+                    record['error'] = error.__class__.__name__
+                    self.add_request_record(record, 0)
+                raise
+
+    def count_request(self):
+        """Count a request about to be sent, which earns a fraction of a retry token, see may_retry()."""
+        max_tokens, tokens_per_request = self.retry_budget
+        with self.lock:
+            self.requests_sent += 1
+            self.retry_tokens = min(self.retry_tokens + tokens_per_request, max_tokens)
+
+    def may_retry(self, attempt):
+        """Return whether a request that failed attempt + 1 times may be sent again.
+        Besides self.max_retries per request, retries are limited by a token bucket (see self.retry_budget) so that
+        a failing server isn't flooded with retries: every retry takes a token and tokens are only earned by sending
+        requests, up to a few saved up. During an outage retries are thus kept to a fraction of the requests however
+        long the process has been running."""
+        with self.lock:
+            return attempt < self.max_retries and self.retry_tokens >= 1
+
+    def retry(self, attempt, record):
+        """Wait for an exponential backoff with jitter before retrying and return the next attempt number."""
+        with self.lock:
+            self.retries_sent += 1
+            self.retry_tokens -= 1
+        if record is not None:
+            record['retries'] = attempt + 1
+        backoff = 0.2 * 2 ** attempt * random.uniform(0.5, 1.5)
+        self.log('Retrying in %.2f s.' % backoff)
+        time.sleep(backoff)
+        return attempt + 1
+
+    def get_hedge_delay(self, endpoint):
+        """Return the 95th percentile of the time to the response headers of recent requests to an endpoint,
+        or self.hedge_delay if there haven't been enough of them."""
+        with self.lock:
+            records = list(self.request_log)
+        latencies = sorted(record['ttfb'] for record in records
+                           if record['endpoint'] == endpoint and record['ttfb'] is not None)
+        if len(latencies) < 20:
+            return self.hedge_delay
+        return latencies[int(len(latencies) * 0.95)]
+
+    def send_hedged(self, send, delay):
+        """Call send() in a thread and, if it hasn't returned within delay seconds, once more in a second one.
+        Return the first response along with whether the second request was sent. Responses that lose the race
+        are closed. If every request fails, the first error is re-raised."""
+        condition = threading.Condition()
+        results = []  # (response, exc_info) in the order the requests finished
+        state = {'hedge_due': False, 'done': False}
+
+        def attempt():
+            try:
+                result = (send(), None)
+            except Exception:
+                result = (None, sys.exc_info())
+            with condition:
+                if state['done'] and result[0] is not None:
+                    result[0].close()
+                results.append(result)
+                condition.notify()
+
+        def start_attempt():
+            self.count_request()
+            attempt_thread = threading.Thread(target=attempt)
+            attempt_thread.daemon = True
+            attempt_thread.start()
+
+        def hedge_due():
+            with condition:
+                state['hedge_due'] = True
+                condition.notify()
+
+        # a timer and untimed waits, as waiting with a timeout polls in Python 2
+        timer = threading.Timer(delay, hedge_due)
+        start_attempt()
+        started = 1
+        timer.start()
+        with condition:
+            while True:
+                responses = [response for response, exc_info in results if response is not None]
+                if responses or len(results) == started:
+                    break
+                if state['hedge_due'] and started == 1:
+                    self.log('Sending a hedged request.')
+                    start_attempt()
+                    started = 2
+                    continue
+                condition.wait()
+            state['done'] = True
+            for response in responses[1:]:
+                response.close()
+        timer.cancel()
+
+        if not responses:
+            exc_info = results[0][1]
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return responses[0], started == 2
+
+    @contextmanager
+    def single_flight(self, name):
+        """Let only one process at a time run the guarded block, using an in-flight marker file in settings_folder.
+        Yields whether the marker was held by another process that had to be waited for first.
+        Markers older than self.lock_timeout are considered left behind by a crashed process. The holder writes
+        a token of its own into the marker, refreshes its mtime while the block runs (see keep_lock_fresh())
+        and only removes the marker if it still holds its token."""
+        lock_file = os.path.join(self.settings_folder, '%s.lock' % name)
+        token = uuid.uuid4().hex
+        waited = False
+        while True:
+            try:
+                fd_lock = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+            else:
+                try:
+                    os.write(fd_lock, token)
+                finally:
+                    os.close(fd_lock)
+                break
+            try:
+                if time.time() - os.path.getmtime(lock_file) > self.lock_timeout:
+                    self.log('Removing stale in-flight marker: %s' % lock_file)
+                    os.remove(lock_file)
+                    continue
+            except OSError:  # released in the meantime
+                continue
+            waited = True
+            time.sleep(0.05)
+        stop_refreshing = self.keep_lock_fresh(lock_file, token)
+        try:
+            yield waited
+        finally:
+            stop_refreshing()
+            if self.read_lock_token(lock_file) == token:
+                try:
+                    os.remove(lock_file)
+                except OSError:
+                    pass
+
+    def keep_lock_fresh(self, lock_file, token):
+        """Touch a held in-flight marker every third of self.lock_timeout so that guarded blocks taking longer than
+        that, e.g. slow downloads or retries, aren't taken over by other processes. Return a function that stops it.
+        A chain of timers is used as waiting with a timeout polls in Python 2."""
+        state = {'held': True, 'timer': None}
+
+        def refresh():
+            if not state['held']:
+                return
+            if self.read_lock_token(lock_file) == token:
+                try:
+                    os.utime(lock_file, None)
+                except OSError:
+                    pass
+            schedule()
+
+        def schedule():
+            timer = threading.Timer(self.lock_timeout / 3.0, refresh)
+            timer.daemon = True  # never keep the process alive
+            state['timer'] = timer
+            if state['held']:
+                timer.start()
+
+        def stop():
+            state['held'] = False
+            timer = state['timer']
+            timer.cancel()
+            if timer.is_alive():  # a daemon thread still waiting when the interpreter exits makes it print errors
+                timer.join()
+
+        schedule()
+        return stop
+
+    def read_lock_token(self, lock_file):
+        try:
+            with open(lock_file, 'rb') as fh_lock:
+                return fh_lock.read()
+        except IOError:
+            return None
+
+    def save_cookies(self):
+        """Write the cookie jar to disk if any cookie changed. Call this once before the process exits."""
+        with self.lock:
+            if self.cookie_jar.changed:
+                self.log('Saving cookies.')
+                temp_path = '%s.%s.tmp' % (self.cookie_jar.filename, uuid.uuid4().hex)
+                self.cookie_jar.save(temp_path, ignore_discard=True, ignore_expires=False)
+                self.replace_file(temp_path, self.cookie_jar.filename)
+
+    def write_file(self, path, data):
+        """Write data to a file atomically (temp file + rename) so readers never see a torn file."""
+        temp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as fh_temp:
+            fh_temp.write(data)
+        self.replace_file(temp_path, path)
+
+    def replace_file(self, temp_path, path):
+        try:
+            os.rename(temp_path, path)
+        except OSError:  # Windows won't rename over an existing file
+            os.remove(path)
+            os.rename(temp_path, path)
+
+    def get_cache_key(self, url, payload=None, headers=None):
+        """Return the cache key for a request. The Authorization header is left out as it changes on every refresh."""
+        if headers:
+            headers = dict((key, value) for key, value in headers.items() if key != 'Authorization')
+        request_data = json.dumps([url, payload, headers], sort_keys=True)
+        return hashlib.md5(request_data).hexdigest()
+
+    def read_cache(self, cache_key):
+        """Return the metadata and content of a cached response, see open_cache()."""
+        cache_meta, fh_cache = self.open_cache(cache_key)
+        if not cache_meta:
+            return None, None
+        with fh_cache:
+            return cache_meta, fh_cache.read()
+
+    def open_cache(self, cache_key):
+        """Return the metadata of a cached response and its file opened at the start of the content, or None, None.
+        The file's mtime is used as the time it was stored."""
+        try:
+            fh_cache = open(os.path.join(self.cache_folder, cache_key), 'rb')
+        except IOError:
+            return None, None
+        try:
+            cache_meta = json.loads(fh_cache.readline())
+            cache_meta['stored'] = os.fstat(fh_cache.fileno()).st_mtime
+            return cache_meta, fh_cache
+        except (IOError, OSError, ValueError):
+            fh_cache.close()
+            return None, None
+
+    def write_cache(self, cache_key, cache_meta, cache_content):
+        """Store a response in the cache folder and evict the oldest entries if the size limit is exceeded.
+        Responses larger than the limit itself aren't stored, they would be evicted right away."""
+        cache_file = os.path.join(self.cache_folder, cache_key)
+        if len(cache_content) > self.cache_size_limit:
+            self.log('Not caching %s bytes, the cache is limited to %s.' % (len(cache_content), self.cache_size_limit))
+            self.remove_cache(cache_key)  # an older version would only be revalidated against the new one
+            return
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        self.write_file(cache_file, json.dumps(cache_meta) + '\n' + cache_content)
+        self.evict_cache(keep=cache_key)
+
+    def remove_cache(self, cache_key):
+        try:
+            os.remove(os.path.join(self.cache_folder, cache_key))
+        except OSError:
+            pass
+
+    def touch_cache(self, cache_key):
+        """Mark a cached response as freshly stored."""
+        try:
+            os.utime(os.path.join(self.cache_folder, cache_key), None)
+        except OSError:
+            pass
+
+    def evict_cache(self, keep=None):
+        """Remove the least recently stored responses until the cache fits within self.cache_size_limit.
+        The entry keep, the one just stored, is never removed, whatever the mtimes of the others."""
+        cache_entries = []
+        for filename in os.listdir(self.cache_folder):
+            cache_file = os.path.join(self.cache_folder, filename)
+            try:
+                file_stat = os.stat(cache_file)
+            except OSError:
+                continue
+            if filename.endswith('.tmp') and time.time() - file_stat.st_mtime < self.lock_timeout:
+                continue  # being written, see download_cache()
+            cache_entries.append((file_stat.st_mtime, file_stat.st_size, filename, cache_file))
+
+        cache_size = sum(entry[1] for entry in cache_entries)
+        for mtime, size, filename, cache_file in sorted(cache_entries):
+            if cache_size <= self.cache_size_limit:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+            cache_size -= size
+
     def get_reg_code(self):
         """Return an activation code needed to authenticate to TV provider."""
         url = self.reg_url + '/ws/subscription/flow/foxSportGo.init'
@@ -154,11 +888,12 @@ class fsgolib(object):
 
     def refresh_session(self):
         """Refreshes auth data and verifies that the session is still valid."""
-        url = self.base_url + '/sessions/%s/refresh' % self.get_credentials()['session_id']
+        credentials = self.get_credentials()
+        url = self.base_url + '/sessions/%s/refresh' % credentials['session_id']
         headers = {
             'Accept': 'application/vnd.session-service+json; version=1',
             'Content-Type': 'application/vnd.session-service+json; version=1',
-            'Authorization': self.get_credentials()['auth_header']
+            'Authorization': credentials['auth_header']
         }
 
         req = self.make_request(url=url, method='put', headers=headers, return_req=True)
@@ -183,29 +918,24 @@ class fsgolib(object):
 
     def save_credentials(self, session_id=None, auth_header=None, access_token=None, session_expires=None,
                          reg_expires=None, logged_in=False):
-        credentials = {}
-        if not session_id:
-            session_id = self.get_credentials()['session_id']
-        if not auth_header:
-            auth_header = self.get_credentials()['auth_header']
-        if not access_token:
-            access_token = self.get_credentials()['access_token']
-        if not session_expires:
-            session_expires = self.get_credentials()['session_expires']
-        if not reg_expires:
-            reg_expires = self.get_credentials()['reg_expires']
-        if not logged_in:
-            logged_in = self.get_credentials()['logged_in']
-
-        credentials['session_id'] = session_id
-        credentials['auth_header'] = auth_header
-        credentials['access_token'] = access_token
-        credentials['session_expires'] = session_expires
-        credentials['reg_expires'] = reg_expires
-        credentials['logged_in'] = logged_in
-
-        with open(self.credentials_file, 'w') as fh_credentials:
-            fh_credentials.write(json.dumps(credentials))
+        """Update the credentials. The credentials file is only rewritten if something changed."""
+        with self.lock:
+            credentials = dict(self.get_credentials())
+            if session_id:
+                credentials['session_id'] = session_id
+            if auth_header:
+                credentials['auth_header'] = auth_header
+            if access_token:
+                credentials['access_token'] = access_token
+            if session_expires:
+                credentials['session_expires'] = session_expires
+            if reg_expires:
+                credentials['reg_expires'] = reg_expires
+            if logged_in:
+                credentials['logged_in'] = logged_in
+
+            if credentials != self.credentials:
+                self.write_credentials(credentials)
 
     def reset_credentials(self):
         credentials = {}
@@ -217,31 +947,50 @@ class fsgolib(object):
         credentials['reg_expires'] = utcnow.isoformat()
         credentials['logged_in'] = False
 
-        with open(self.credentials_file, 'w') as fh_credentials:
-            fh_credentials.write(json.dumps(credentials))
+        self.write_credentials(credentials)
+
+    def write_credentials(self, credentials):
+        """Replace the credentials. The dict is never modified afterwards so readers in other threads
+        always see a complete set."""
+        with self.lock:
+            self.credentials = credentials
+            self.write_file(self.credentials_file, json.dumps(credentials))
+
+    def reload_credentials(self):
+        """Forget the credentials so that they're read from the credentials file again on next use,
+        e.g. after another process logged in or refreshed the session."""
+        with self.lock:
+            self.credentials = None
 
     def get_credentials(self):
-        try:
-            with open(self.credentials_file, 'r') as fh_credentials:
-                return json.loads(fh_credentials.read())
-        except IOError:
-            self.reset_credentials()
-            with open(self.credentials_file, 'r') as fh_credentials:
-                return json.loads(fh_credentials.read())
+        """Return the credentials. The credentials file is only read once per settings folder and process,
+        until reload_credentials() is called."""
+        credentials = self.credentials
+        if credentials is None:
+            with self.lock:
+                if self.credentials is None:
+                    try:
+                        with open(self.credentials_file, 'r') as fh_credentials:
+                            self.credentials = json.loads(fh_credentials.read())
+                    except (IOError, ValueError):
+                        self.reset_credentials()
+                credentials = self.credentials
+        return credentials
 
     def valid_session(self):
         """Return whether the session is valid or not."""
+        credentials = self.get_credentials()
         try:
             utcnow = datetime.utcnow()
-            session_expires = self.parse_datetime(self.get_credentials()['session_expires'])
+            session_expires = self.parse_datetime(credentials['session_expires'])
             session_expires = session_expires.replace(tzinfo=None)
-            reg_expires = self.parse_datetime(self.get_credentials()['reg_expires'])
+            reg_expires = self.parse_datetime(credentials['reg_expires'])
             reg_expires = reg_expires.replace(tzinfo=None)
 
             session_valid = session_expires >= utcnow
             reg_valid = reg_expires >= utcnow
 
-            if self.get_credentials()['logged_in'] and session_valid and reg_valid:
+            if credentials['logged_in'] and session_valid and reg_valid:
                 return True
             else:
                 return False
@@ -250,8 +999,47 @@ class fsgolib(object):
             self.reset_credentials()
             return False
 
+    def session_expires_soon(self):
+        """Return whether the session expires within self.session_refresh_margin."""
+        session_expires = self.parse_datetime(self.get_credentials()['session_expires'])
+        session_expires = session_expires.replace(tzinfo=None)
+        return session_expires - datetime.utcnow() < self.session_refresh_margin
+
+    def keep_alive(self):
+        """Refresh a valid session that's about to expire so that it never has to be done on the interactive path.
+        Call this whenever the user isn't waiting. Return whether the session was refreshed."""
+        if not (self.valid_session() and self.session_expires_soon()):
+            return False
+        import requests
+        with self.single_flight('session') as waited:
+            if waited:  # another process may have refreshed the session already
+                self.reload_credentials()
+                if not (self.valid_session() and self.session_expires_soon()):
+                    return False
+            try:
+                self.refresh_session()
+                self.log('Refreshed session ahead of expiry.')
+                return True
+            except self.LoginFailure as error:
+                self.log('Failed to refresh session ahead of expiry: %s' % error.value)
+            except (requests.exceptions.RequestException, ValueError, KeyError) as error:
+                self.log('Failed to refresh session ahead of expiry: %s' % error)
+        return False
+
     def login(self, reg_code=None):
-        """Complete login process. Errors are raised as LoginFailure."""
+        """Complete login process. Errors are raised as LoginFailure.
+        Only one process at a time refreshes or registers the session, see single_flight(). The others wait for it
+        and use the session it left if that's valid, e.g. when several widgets start with an expired session."""
+        with self.single_flight('session') as waited:
+            if waited:
+                self.reload_credentials()
+                if self.valid_session() and not self.session_expires_soon():
+                    self.log('Session was renewed by another process.')
+                    return
+            self.renew_session(reg_code)
+
+    def renew_session(self, reg_code=None):
+        """Refresh the session, register a new one if it has expired or register the device with reg_code."""
         credentials = self.get_credentials()
         if credentials['session_id'] and credentials['auth_header']:
             try:
@@ -280,40 +1068,83 @@ class fsgolib(object):
                 self.log('No registration code supplied.')
                 raise self.LoginFailure('NoRegCodeSupplied')
 
-    def get_stream_url(self, channel_id, airing_id=None):
-        """Return the stream URL for an event."""
-        stream_url = {}
-        url = self.base_url + '/platform/ios-tablet~3.1.1/channel/%s' % channel_id
-        if airing_id:
-            url = url + '/airing/%s' % airing_id
+    def get_stream_url(self, channel_id, airing_id=None, parse_manifest=True):
+        """Return the stream URL for an event. The master manifest is only downloaded and split into
+        bitrates if parse_manifest is True. Resolved streams are reused until their URL or the session expires."""
+        stream_key = 'stream_%s_%s' % (channel_id, airing_id)
+        stream_url = self.get_cached_stream(stream_key)
+        if stream_url:
+            self.log('Using cached stream URL.')
+        else:
+            stream_url = {}
+            url = self.base_url + '/platform/ios-tablet~3.1.1/channel/%s' % channel_id
+            if airing_id:
+                url = url + '/airing/%s' % airing_id
 
-        headers = {
-            'Accept': 'application/vnd.media-service+json; version=1',
-            'Authorization': self.get_credentials()['auth_header']
-        }
+            headers = {
+                'Accept': 'application/vnd.media-service+json; version=1',
+                'Authorization': self.get_credentials()['auth_header']
+            }
 
-        stream_data = self.make_request(url=url, method='get', headers=headers)
-        stream_dict = json.loads(stream_data)
-        if 'errors' in stream_dict.keys():
-            errors = []
-            for error in stream_dict['errors']:
-                errors.append(error)
-            errors = ', '.join(errors)
-            self.log('Failed to get stream URL. Error(s): %s' % errors)
-        else:
-            stream_url['manifest'] = stream_dict['stream']['location']
+            stream_data = self.make_request(url=url, method='get', headers=headers, endpoint='stream')
+            stream_dict = json.loads(stream_data)
+            if 'errors' in stream_dict.keys():
+                errors = []
+                for error in stream_dict['errors']:
+                    errors.append(error)
+                errors = ', '.join(errors)
+                self.log('Failed to get stream URL. Error(s): %s' % errors)
+                return stream_url
+            else:
+                stream_url['manifest'] = stream_dict['stream']['location']
+
+        if parse_manifest and 'bitrates' not in stream_url:
             stream_url['bitrates'] = self.parse_m3u8_manifest(stream_url['manifest'])
+            self.save_cached_stream(stream_key, stream_url)
+        elif 'expires' not in stream_url:
+            self.save_cached_stream(stream_key, stream_url)
 
         return stream_url
 
+    def get_stream_expiry(self, manifest_url):
+        """Return the unix timestamp a resolved stream should be reused until.
+        The expiry token in the manifest URL is used when there is one, capped by the session lifetime."""
+        session_expires = self.parse_datetime(self.get_credentials()['session_expires'])
+        session_expires = calendar.timegm(session_expires.utctimetuple())
+        match = STREAM_EXPIRY_REGEX.search(manifest_url)
+        if match:
+            stream_expires = int(match.group(1)) - 30  # leave some time to start playback
+        else:
+            stream_expires = time.time() + self.stream_ttl
+        return min(stream_expires, session_expires)
+
+    def get_cached_stream(self, stream_key):
+        """Return a previously resolved stream if it's still valid."""
+        stream_meta, stream_data = self.read_cache(stream_key)
+        if stream_meta and stream_meta['auth_header'] == self.get_credentials()['auth_header']:
+            stream_url = json.loads(stream_data)
+            if stream_url['expires'] > time.time():
+                return stream_url
+        return None
+
+    def save_cached_stream(self, stream_key, stream_url):
+        stream_url['expires'] = self.get_stream_expiry(stream_url['manifest'])
+        stream_meta = {'auth_header': self.get_credentials()['auth_header']}
+        self.write_cache(stream_key, stream_meta, json.dumps(stream_url))
+
+    def save_stream_bitrate(self, channel_id, airing_id, bitrate):
+        """Remember the bitrate chosen for a resolved stream so re-tuning to it doesn't ask again."""
+        stream_key = 'stream_%s_%s' % (channel_id, airing_id)
+        stream_url = self.get_cached_stream(stream_key)
+        if stream_url and stream_url.get('bitrate') != bitrate:
+            stream_url['bitrate'] = bitrate
+            self.save_cached_stream(stream_key, stream_url)
+
     def parse_m3u8_manifest(self, manifest_url):
         """Return the stream URL along with its bitrate."""
         streams = {}
         m3u8_manifest = self.make_request(manifest_url, 'get')
-        m3u8_header = {
-            'Authorization': self.get_credentials()['auth_header'],
-            'User-Agent': 'FOX Sports GO/2836 CFNetwork/711.1.16 Darwin/14.0.0'
-        }
+        import m3u8
         m3u8_obj = m3u8.loads(m3u8_manifest)
         for playlist in m3u8_obj.playlists:
             bitrate = int(playlist.stream_info.bandwidth) / 1000
@@ -321,21 +1152,166 @@ class fsgolib(object):
                 stream_url = playlist.uri
             else:
                 stream_url = manifest_url[:manifest_url.rfind('/') + 1] + playlist.uri
-            streams[str(bitrate)] = stream_url + '|' + urlencode(m3u8_header)
+            streams[str(bitrate)] = self.get_playback_url(stream_url)
 
         return streams
 
-    def get_schedule(self, schedule_type, start_date=None, end_date=None, size='999', filter_date=False, deportes='true',
-                     search_query=None, search_filter=None):
-        """Retrieve the FS GO schedule in a dict."""
+    def get_playback_url(self, stream_url):
+        """Return the stream URL with the headers needed for playback appended in Kodi's url|headers notation."""
+        m3u8_header = {
+            'Authorization': self.get_credentials()['auth_header'],
+            'User-Agent': 'FOX Sports GO/2836 CFNetwork/711.1.16 Darwin/14.0.0'
+        }
+        return stream_url + '|' + urlencode(m3u8_header)
+
+    def measure_throughput(self, stream_url, probe_size=1024 * 1024):
+        """Time the download of (the first probe_size bytes of) a segment from a variant playlist.
+        Return the measured throughput in Kbps and remember it for get_throughput()."""
+        playlist_url, _, header_string = stream_url.partition('|')
+        headers = dict(parse_qsl(header_string))
+        import m3u8
+        m3u8_obj = m3u8.loads(self.make_request(playlist_url, 'get', headers=headers))
+        if not m3u8_obj.segments:
+            return None
+        if m3u8_obj.is_endlist:
+            segment = m3u8_obj.segments[0]
+        else:  # live streams are played from the end of the playlist
+            segment = m3u8_obj.segments[-1]
+
+        start_time = time.time()
+        req = self.http_session.get(urljoin(playlist_url, segment.uri), headers=headers, stream=True,
+                                    verify=self.verify_ssl, timeout=self.timeouts['default'])
+        received = 0
+        try:
+            for chunk in req.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= probe_size:
+                    break
+        finally:
+            req.close()
+        elapsed = max(time.time() - start_time, 0.001)
+
+        throughput = received * 8 / 1000 / elapsed
+        self.log('Measured throughput: %s Kbps (%s bytes in %.2f s)' % (int(throughput), received, elapsed))
+        self.save_throughput(throughput)
+        return throughput
+
+    def save_throughput(self, throughput):
+        measurements = self.get_throughput_measurements()[-4:]
+        measurements.append([time.time(), throughput])
+        self.write_cache('throughput', {}, json.dumps(measurements))
+
+    def get_throughput_measurements(self, max_age=None):
+        """Return the throughput measurements younger than max_age seconds (default self.throughput_ttl) as
+        [timestamp, Kbps] pairs, oldest first."""
+        throughput_meta, throughput_data = self.read_cache('throughput')
+        if not throughput_meta:
+            return []
+        max_age = self.throughput_ttl if max_age is None else max_age
+        return [measurement for measurement in json.loads(throughput_data)
+                if time.time() - measurement[0] < max_age]
+
+    def get_throughput(self):
+        """Return the median of the recent throughput measurements in Kbps or None if there aren't any."""
+        measurements = sorted(measurement[1] for measurement in self.get_throughput_measurements())
+        if measurements:
+            return measurements[len(measurements) // 2]
+        else:
+            return None
+
+    def get_auto_bitrate(self, streams, headroom=0.75):
+        """Return the highest bitrate that fits within the available throughput with some headroom.
+        streams is a dict as returned by parse_m3u8_manifest. The throughput is measured on the lowest
+        bitrate if there's no recent measurement. If measuring fails, the last measurement however old is used,
+        or the lowest bitrate if there's none, so that a CDN hiccup doesn't prevent playback."""
+        lowest_bitrate = min(streams.keys(), key=int)
+        throughput = self.get_throughput()
+        if throughput is None:
+            try:
+                throughput = self.measure_throughput(streams[lowest_bitrate])
+            except (IOError, ValueError) as error:  # requests' exceptions are IOErrors
+                self.log('Failed to measure throughput: %s' % error)
+                measurements = self.get_throughput_measurements(max_age=float('inf'))
+                throughput = measurements[-1][1] if measurements else None
+        if not throughput:
+            return lowest_bitrate
+
+        fitting_bitrates = [bitrate for bitrate in streams.keys() if int(bitrate) <= throughput * headroom]
+        if fitting_bitrates:
+            return max(fitting_bitrates, key=int)
+        else:
+            return lowest_bitrate
+
+    def get_schedule(self, schedule_type, start_date=None, end_date=None, offset=0, size=None, filter_date=False,
+                     deportes='true', search_query=None, search_filter=None):
+        """Retrieve the FS GO schedule as Event objects. Events are yielded as they're parsed from the response unless
+        filter_date is set, in which case a list is returned from the schedule index.
+        The featured and search schedules are paged, offset and size (default self.page_size) select the page."""
+        if filter_date:  # filter_date should be 'today' or date string in %Y-%m-%d format
+            return self.get_schedule_by_date(filter_date, deportes=deportes)
+
+        schedule_chunks = self.get_schedule_data(schedule_type, start_date=start_date, end_date=end_date,
+                                                 offset=offset, size=size, deportes=deportes,
+                                                 search_query=search_query, search_filter=search_filter, stream=True)
+        return (self.parse_event(item) for item in self.iter_items(schedule_chunks))
+
+    def get_home_schedule(self, deportes='true'):
+        """Return the live, featured and today's events without duplicate airings, in that order.
+        The three are fetched concurrently over the shared session."""
+        schedules = self.run_concurrently([
+            lambda: list(self.get_schedule('live', deportes=deportes)),
+            lambda: list(self.get_schedule('featured', deportes=deportes)),
+            lambda: self.get_schedule('all', filter_date='today', deportes=deportes)
+        ])
+
+        events = []
+        airing_ids = set()
+        for schedule in schedules:
+            for event in schedule:
+                if event.airing.airing_id not in airing_ids:
+                    airing_ids.add(event.airing.airing_id)
+                    events.append(event)
+
+        return events
+
+    def run_concurrently(self, functions):
+        """Call each function in its own thread and return their results in order.
+        If any of them raised an exception the first one is re-raised once all have finished."""
+        results = [None] * len(functions)
+        errors = []
+
+        def run(position, function):
+            try:
+                results[position] = function()
+            except Exception:
+                errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target=run, args=(position, function))
+                   for position, function in enumerate(functions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+        return results
+
+    def get_schedule_data(self, schedule_type, start_date=None, end_date=None, offset=0, size=None, deportes='true',
+                          search_query=None, search_filter=None, stream=False):
+        """Return the raw schedule response, or an iterator over its chunks if stream is True."""
+        size = size or self.page_size
         if schedule_type == 'live':
             url = self.base_url + '/epg/ws/live/all'
             payload = None
+            cache_name = 'live'
         elif schedule_type == 'featured':
-            url = self.base_url + '/epg/ws/featured/all/offset/0/size/%s' % size
+            url = self.base_url + '/epg/ws/featured/all/offset/%s/size/%s' % (offset, size)
             payload = None
+            cache_name = 'featured'
         elif schedule_type == 'search':
-            url = self.base_url + '/epg/ws/search/offset/0/size/%s' % size
+            url = self.base_url + '/epg/ws/search/offset/%s/size/%s' % (offset, size)
+            cache_name = 'search'
             payload = {
                 'search_type': 'programs',
                 'search': search_query,
@@ -343,10 +1319,7 @@ class fsgolib(object):
             }
         else:
             url = self.base_url + '/epg/ws/schedule'
-            if filter_date:
-                # send current UTC time as start_date to grab all events
-                utcnow = datetime.utcnow()
-                start_date = utcnow.isoformat()
+            cache_name = 'schedule'
             payload = {
                 # this should be a UTC date string in iso8601 format
                 'start_date': str(start_date),
@@ -357,70 +1330,261 @@ class fsgolib(object):
             'deportes': deportes  # 'true' or 'false'
         }
 
-        schedule_data = self.make_request(url=url, method='get', payload=payload, headers=headers)
-        schedule_dict = json.loads(schedule_data)
-        schedule = schedule_dict['body']['items']
+        return self.make_request(url=url, method='get', payload=payload, headers=headers, cache_name=cache_name,
+                                 stream=stream)
 
-        if filter_date:  # filter_date should be 'today' or date string in %Y-%m-%d format
-            schedule_filtered = []
-            if filter_date == 'today':
-                now = datetime.now()
-                date_today = now.date()
-                date_to_filter = date_today
-            else:
-                filter_date_obj = datetime(*(time.strptime(filter_date, '%Y-%m-%d')[0:6]))  # http://forum.kodi.tv/showthread.php?tid=112916
-                date_to_filter = filter_date_obj.date()
-            for event in schedule:
-                event_datetime_obj = self.parse_datetime(event['airings'][0]['airing_date'], localize=True)
-                event_date = event_datetime_obj.date()
-                if date_to_filter == event_date:
-                    schedule_filtered.append(event)
-                if filter_date == 'today':
-                    # include current live events on 24h cutover
-                    if event['airings'][0]['is_live']:
-                        if event not in schedule_filtered:
-                            schedule_filtered.append(event)
-            return schedule_filtered
+    def prefetch_schedule(self, schedule_type, offset=0, deportes='true', search_query=None, search_filter=None):
+        """Download a schedule page into the cache so that opening it later doesn't wait for the network."""
+        try:
+            self.get_schedule_data(schedule_type, offset=offset, deportes=deportes, search_query=search_query,
+                                   search_filter=search_filter)
+        except IOError as error:  # requests' exceptions are IOErrors, so a cache hit doesn't need to import requests
+            self.log('Failed to prefetch schedule page: %s' % error)
+
+    def get_schedule_index(self, deportes='true'):
+        """Return the upcoming schedule along with its events bucketed by local date, the positions of live events
+        and the positions of the events each search token (see get_search_tokens()) appears in.
+        The index is stored in the cache and only the windows of the schedule that are out of date are fetched again
+        and merged into it by airing_id, see get_stale_windows()."""
+        if self.schedule_index and self.schedule_index['deportes'] == deportes and \
+                not self.get_stale_windows(self.schedule_index['windows']):
+            return self.schedule_index
+
+        index_key = 'schedule_index_%s' % deportes
+        with self.single_flight(index_key):
+            schedule_index = self.read_schedule_index(index_key)
+            stale_windows = self.get_stale_windows(schedule_index['windows'])
+            if stale_windows:
+                airings = dict((event.airing.airing_id, event) for event in schedule_index['events'])
+                windows = schedule_index['windows']
+                for window_names, start, end in stale_windows:
+                    # the window starting now also replaces the airings that have ended
+                    replace_from = None if 'near' in window_names else start
+                    self.sync_schedule_window(airings, start, end, replace_from, deportes)
+                    for window_name in window_names:
+                        windows[window_name] = [start, time.time()]
+                schedule_index = self.build_schedule_index(airings.values(), windows)
+                self.write_schedule_index(index_key, schedule_index)
+
+        schedule_index['deportes'] = deportes
+        schedule_index['sorted_tokens'] = sorted(schedule_index['tokens'])
+        self.schedule_index = schedule_index
+        return schedule_index
+
+    def get_stale_windows(self, windows):
+        """Return the windows of the schedule that need to be fetched as (window names, start, end) tuples of unix
+        timestamps, end being None for open ended windows. The 'near' window covers the next schedule_window seconds
+        and is fetched again every schedule cache period, its start is rounded down to that period so that processes
+        within the same period share one cache entry. The 'ahead' window covers the rest of the schedule and is
+        fetched again after schedule_ahead_ttl. windows maps window names to [start, fetched] as stored in the index."""
+        period = self.cache_ttls['schedule']
+        near_start = int(time.time()) // period * period
+        near_end = near_start + self.schedule_window
+        near_stale = 'near' not in windows or windows['near'][0] < near_start
+        ahead_stale = 'ahead' not in windows or time.time() - windows['ahead'][1] > self.schedule_ahead_ttl
+        if near_stale and ahead_stale:  # one request for both
+            return [(('near', 'ahead'), near_start, None)]
+        elif near_stale:
+            return [(('near',), near_start, near_end)]
+        elif ahead_stale:
+            return [(('ahead',), near_end, None)]
+        else:
+            return []
+
+    def sync_schedule_window(self, airings, start, end=None, replace_from=None, deportes='true'):
+        """Fetch the events airing from start until end (unix timestamps, open ended if end is None) and merge them
+        into airings, a dict of airing_id: Event. Airings from replace_from (or any time if None) until end that
+        aren't in the response anymore, e.g. because they have ended, are removed."""
+        start_date = datetime.utcfromtimestamp(start).isoformat()
+        end_date = datetime.utcfromtimestamp(end).isoformat() if end else None
+        self.log('Syncing schedule from %s until %s.' % (start_date, end_date))
+        schedule_data = self.get_schedule_data('all', start_date=start_date, end_date=end_date, deportes=deportes)
+        for airing_id, event in airings.items():
+            airing_time = calendar.timegm(event.airing.airing_date.utctimetuple())
+            if (replace_from is None or airing_time >= replace_from) and (end is None or airing_time < end):
+                del airings[airing_id]
+        for item in json.loads(schedule_data)['body']['items']:
+            event = self.parse_event(item)
+            airings[event.airing.airing_id] = event
+
+    def build_schedule_index(self, events, windows):
+        self.log('Building schedule index.')
+        schedule_index = {
+            'events': sorted(events, key=lambda event: (event.airing.airing_date, event.airing.airing_id)),
+            'dates': {},
+            'live': [],
+            'tokens': {},
+            'windows': windows
+        }
+        for position, event in enumerate(schedule_index['events']):
+            event_date = self.utc_to_local(event.airing.airing_date).date()
+            schedule_index['dates'].setdefault(event_date.isoformat(), []).append(position)
+            if event.airing.is_live:
+                schedule_index['live'].append(position)
+            for token in self.get_search_tokens(event):
+                schedule_index['tokens'].setdefault(token, []).append(position)
+        return schedule_index
+
+    def read_schedule_index(self, index_key):
+        """Return the stored schedule index, or an empty one if there's none in the current format."""
+        index_meta, index_data = self.read_cache(index_key)
+        if index_meta and index_meta.get('fields') == list(Event.fields):
+            schedule_index = json.loads(index_data)
+            if 'windows' in schedule_index:
+                schedule_index['events'] = [Event.from_list(values) for values in schedule_index['events']]
+                return schedule_index
+        return {'events': [], 'windows': {}}
+
+    def write_schedule_index(self, index_key, schedule_index):
+        index_data = dict(schedule_index, events=[event.to_list() for event in schedule_index['events']])
+        self.write_cache(index_key, {'fields': Event.fields}, json.dumps(index_data))
+
+    def get_schedule_by_date(self, filter_date, deportes='true'):
+        """Return the events airing on a local date. filter_date should be 'today' or date string in %Y-%m-%d format."""
+        schedule_index = self.get_schedule_index(deportes)
+        if filter_date == 'today':
+            positions = set(schedule_index['dates'].get(datetime.now().date().isoformat(), []))
+            # include current live events on 24h cutover
+            positions.update(schedule_index['live'])
+            positions = sorted(positions)
         else:
-            return schedule
+            positions = schedule_index['dates'].get(filter_date, [])
+
+        return [schedule_index['events'][position] for position in positions]
+
+    def get_search_tokens(self, event):
+        """Return the set of lowercase words in the title, sport tag and channel name of an event."""
+        text = u' '.join(field for field in (event.title, event.sport_tag, event.airing.channel_name) if field)
+        return set(SEARCH_TOKEN_REGEX.findall(text.lower()))
+
+    def get_cached_schedule_index(self, deportes='true'):
+        """Return the schedule index without fetching anything: the one loaded by this instance or the stored one if
+        it still covers the current time. Return None if there's neither."""
+        if self.schedule_index and self.schedule_index['deportes'] == deportes:
+            return self.schedule_index
+        try:
+            schedule_index = self.read_schedule_index('schedule_index_%s' % deportes)
+        except (ValueError, KeyError, TypeError):
+            return None
+        near_window = schedule_index['windows'].get('near')
+        if not near_window or near_window[0] + self.schedule_window < time.time():
+            return None
+        schedule_index['deportes'] = deportes
+        schedule_index['sorted_tokens'] = sorted(schedule_index['tokens'])
+        self.schedule_index = schedule_index
+        return schedule_index
+
+    def search_schedule(self, search_query, search_filter=None, deportes='true'):
+        """Search the cached upcoming schedule. Return the events in which every word of search_query is the start
+        of a word in the title, sport tag or channel name, in schedule order.
+        search_filter 'events' keeps only events with a sport tag, the API's programs without one are studio shows.
+        Nothing is fetched, an empty list is returned if there's no cached schedule index (see
+        get_cached_schedule_index()) so that the caller asks the server instead."""
+        if isinstance(search_query, str):
+            search_query = search_query.decode('utf-8')
+        schedule_index = self.get_cached_schedule_index(deportes)
+        if not schedule_index:
+            return []
+        tokens = schedule_index['tokens']
+        sorted_tokens = schedule_index['sorted_tokens']
+        positions = None
+        for query_token in set(SEARCH_TOKEN_REGEX.findall(search_query.lower())):
+            token_positions = set()
+            start = bisect.bisect_left(sorted_tokens, query_token)
+            for token in sorted_tokens[start:]:
+                if not token.startswith(query_token):
+                    break
+                token_positions.update(tokens[token])
+            positions = token_positions if positions is None else positions & token_positions
+            if not positions:
+                return []
+
+        events = [schedule_index['events'][position] for position in sorted(positions or [])]
+        if search_filter == 'events':
+            events = [event for event in events if event.sport_tag]
+        return events
 
     def get_channels(self):
-        """Return the available FS GO channels."""
+        """Return the available FS GO channels as Channel objects."""
         url = self.base_url + '/epg/ws/channel/all'
         headers = {'Authorization': self.get_credentials()['auth_header']}
 
-        channel_data = self.make_request(url=url, method='get', headers=headers)
+        channel_data = self.make_request(url=url, method='get', headers=headers, cache_name='channels')
         channel_dict = json.loads(channel_data)
-        channels = channel_dict['body']['items']
+        channels = []
+        for channel in channel_dict['body']['items']:
+            channels.append(Channel(channel['id'], channel.get('name'), self.get_best_image(channel.get('urls'))))
 
         return channels
 
-    def get_event_dates(self):
+    def parse_event(self, event):
+        """Turn an event from the API into an Event object."""
+        airing = event['airings'][0]
+        airing_date = self.parse_datetime(airing['airing_date'])
+        return Event(event['title'], event.get('sport_tag'), self.get_best_image(event.get('urls')),
+                     Airing(airing['channel_id'], airing['airing_id'], airing['channel_name'], airing_date,
+                            airing['is_live'], airing['replay']))
+
+    def get_best_image(self, images):
+        """Return the URL of the highest resolution image in an API image list, or None."""
+        best_image = None
+        highest_res = 0
+        for image in images or []:
+            try:
+                image_res = int(image['size'].split('_')[2])
+            except (KeyError, IndexError, ValueError):
+                continue
+            if image_res > highest_res:
+                best_image = image['src']
+                highest_res = image_res
+
+        return best_image
+
+    def get_event_dates(self, deportes='true'):
         """Return a list of dates in datetime.date format containing at least one event."""
         dates = []
-        utc_now = datetime.utcnow()
-        start_date = utc_now.isoformat()
-        schedule = self.get_schedule('all', start_date=start_date)
-
-        for event in schedule:
-            datetime_obj = self.parse_datetime(event['airings'][0]['airing_date'], localize=True)
-            event_date = datetime_obj.date()
-            if event_date not in dates:
-                dates.append(event_date)
+        for event_date in sorted(self.get_schedule_index(deportes)['dates']):
+            event_date_obj = datetime(*(time.strptime(event_date, '%Y-%m-%d')[0:6]))  # http://forum.kodi.tv/showthread.php?tid=112916
+            dates.append(event_date_obj.date())
 
         return dates
 
     def utc_to_local(self, utc_dt):
+        """Convert a UTC datetime object to naive local time. The local UTC offset is looked up once per hour."""
+        utc_dt = utc_dt.replace(tzinfo=None) - (utc_dt.utcoffset() or timedelta(0))
         # get integer timestamp to avoid precision lost
         timestamp = calendar.timegm(utc_dt.timetuple())
-        local_dt = datetime.fromtimestamp(timestamp)
-        assert utc_dt.resolution >= timedelta(microseconds=1)
-        return local_dt.replace(microsecond=utc_dt.microsecond)
+        hour = timestamp // 3600
+        try:
+            utc_offset = self.utc_offsets[hour]
+        except KeyError:
+            utc_offset = datetime.fromtimestamp(hour * 3600) - datetime.utcfromtimestamp(hour * 3600)
+            if len(self.utc_offsets) >= self.memo_size_limit:
+                self.utc_offsets.clear()
+            self.utc_offsets[hour] = utc_offset
+        return utc_dt + utc_offset
 
     def parse_datetime(self, iso8601_string, localize=False):
-        """Parse ISO8601 string to datetime object."""
-        datetime_obj = iso8601.parse_date(iso8601_string)
-        if localize:
-            return self.utc_to_local(datetime_obj)
+        """Parse ISO8601 string to datetime object.
+        UTC timestamps in the API's format skip the iso8601 module and every result is memoized."""
+        try:
+            return self.parsed_datetimes[(iso8601_string, localize)]
+        except KeyError:
+            pass
+
+        match = ISO8601_UTC_REGEX.match(iso8601_string)
+        if match:
+            year, month, day, hour, minute, second, fraction = match.groups()
+            microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+            datetime_obj = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond,
+                                    UTC_TZINFO)
         else:
-            return datetime_obj
+            import iso8601
+            datetime_obj = iso8601.parse_date(iso8601_string)
+        if localize:
+            datetime_obj = self.utc_to_local(datetime_obj)
+
+        if len(self.parsed_datetimes) >= self.memo_size_limit:
+            self.parsed_datetimes.clear()
+        self.parsed_datetimes[(iso8601_string, localize)] = datetime_obj
+        return datetime_obj
@@ -0,0 +1,190 @@
+﻿# -*- coding: utf-8 -*-
+"""
+A local HLS proxy that prefetches upcoming segments into a bounded memory buffer
+"""
+import re
+import threading
+import BaseHTTPServer
+import SocketServer
+from collections import OrderedDict
+from urllib import urlencode
+from urlparse import urljoin, urlparse, parse_qsl
+
+import requests
+
+# URIs in tag attributes, e.g. #EXT-X-MEDIA:TYPE=AUDIO,URI="audio/en.m3u8" or #EXT-X-KEY:METHOD=AES-128,URI="key"
+URI_ATTRIBUTE_REGEX = re.compile(r'URI="([^"]*)"')
+# tags whose URI attribute points at a playlist, the others (#EXT-X-KEY, #EXT-X-MAP, ...) point at binary data
+PLAYLIST_URI_TAGS = ('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ProxyRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        proxy = self.server.proxy
+        parsed_path = urlparse(self.path)
+        params = dict(parse_qsl(parsed_path.query))
+        try:
+            if parsed_path.path == '/playlist.m3u8':
+                content = proxy.get_playlist(params['url'])
+                content_type = 'application/vnd.apple.mpegurl'
+            elif parsed_path.path == '/segment.ts':
+                content = proxy.get_segment(params['url'])
+                content_type = 'video/mp2t'
+            else:
+                self.send_error(404)
+                return
+        except KeyError:
+            self.send_error(400)
+            return
+        except requests.exceptions.RequestException as error:
+            proxy.log('Upstream error: %s' % error)
+            self.send_error(502)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        self.server.proxy.log(format % args)
+
+
+class hlsproxy(object):
+    def __init__(self, headers=None, prefetch_count=3, buffer_size=None, verify_ssl=True, timeout=(5, 15),
+                 debug=False):
+        """Serve HLS playlists and segments on localhost with the given headers injected.
+        The next prefetch_count segments after each requested one are downloaded concurrently
+        and at most buffer_size segments are kept in memory, by default twice the prefetch_count
+        plus two so that a bitrate switch doesn't evict the segments prefetched for the new variant.
+        Upstream requests time out after the (connect, read) timeout in seconds."""
+        self.headers = headers
+        self.prefetch_count = prefetch_count
+        self.buffer_size = buffer_size or 2 * prefetch_count + 2
+        self.timeout = timeout
+        self.verify_ssl = verify_ssl
+        self.debug = debug
+        self.http_session = requests.Session()
+        self.server = None
+        self.lock = threading.Lock()
+        self.segment_buffer = OrderedDict()  # segment URL: content
+        self.prefetching = {}  # segment URL: threading.Event set once the download finished
+        self.playlist_segments = {}  # playlist URL: segment URLs in playback order
+        self.segment_playlists = {}  # segment URL: playlist URL
+
+    def log(self, string):
+        if self.debug:
+            try:
+                print '[hlsproxy]: %s' % string
+            except:
+                pass
+
+    def start(self):
+        """Start serving on a free port on localhost in a background thread."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ProxyRequestHandler)
+        self.server.proxy = self
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.log('Listening on port %s' % self.server.server_port)
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def get_url(self, playlist_url):
+        """Return the local URL serving a (master or variant) playlist."""
+        return 'http://127.0.0.1:%s/playlist.m3u8?%s' % (self.server.server_port, urlencode({'url': playlist_url}))
+
+    def is_local_url(self, url):
+        """Return whether a URL is served by this proxy."""
+        return self.server is not None and url.startswith('http://127.0.0.1:%s/' % self.server.server_port)
+
+    def fetch(self, url):
+        req = self.http_session.get(url, headers=self.headers, verify=self.verify_ssl, timeout=self.timeout)
+        req.raise_for_status()
+        return req.content
+
+    def get_playlist(self, playlist_url):
+        """Download a playlist and point its URIs at the proxy."""
+        lines = []
+        segments = []
+        for line in self.fetch(playlist_url).splitlines():
+            line = line.strip()
+            if line.startswith('#') and 'URI="' in line:
+                path = 'playlist.m3u8' if line.startswith(PLAYLIST_URI_TAGS) else 'segment.ts'
+                line = URI_ATTRIBUTE_REGEX.sub(
+                    lambda match: 'URI="%s"' % self.get_local_url(path, urljoin(playlist_url, match.group(1))), line)
+            elif line and not line.startswith('#'):
+                uri = urljoin(playlist_url, line)
+                if urlparse(uri).path.endswith('.m3u8'):
+                    line = self.get_local_url('playlist.m3u8', uri)
+                else:
+                    line = self.get_local_url('segment.ts', uri)
+                    segments.append(uri)
+            lines.append(line)
+
+        with self.lock:
+            for segment_url in self.playlist_segments.get(playlist_url, []):
+                self.segment_playlists.pop(segment_url, None)
+            self.playlist_segments[playlist_url] = segments
+            for segment_url in segments:
+                self.segment_playlists[segment_url] = playlist_url
+
+        return '\n'.join(lines) + '\n'
+
+    def get_local_url(self, path, url):
+        return 'http://127.0.0.1:%s/%s?%s' % (self.server.server_port, path, urlencode({'url': url}))
+
+    def get_segment(self, segment_url):
+        """Return a segment from the buffer, waiting for it if it's being prefetched, and prefetch the next ones."""
+        self.prefetch_next(segment_url)
+        with self.lock:
+            download_done = self.prefetching.get(segment_url)
+        if download_done:
+            download_done.wait(60)
+        with self.lock:
+            content = self.segment_buffer.pop(segment_url, None)
+        if content is None:
+            self.log('Buffer miss: %s' % segment_url)
+            content = self.fetch(segment_url)
+        return content
+
+    def prefetch_next(self, segment_url):
+        with self.lock:
+            segments = self.playlist_segments.get(self.segment_playlists.get(segment_url), [])
+            if segment_url not in segments:
+                return
+            position = segments.index(segment_url)
+            next_segments = [url for url in segments[position + 1:position + 1 + self.prefetch_count]
+                             if url not in self.segment_buffer and url not in self.prefetching]
+            for url in next_segments:
+                self.prefetching[url] = threading.Event()
+
+        for url in next_segments:
+            prefetch_thread = threading.Thread(target=self.prefetch, args=(url,))
+            prefetch_thread.daemon = True
+            prefetch_thread.start()
+
+    def prefetch(self, segment_url):
+        """Download a segment into the buffer. get_segment() is released whatever happens, on failure it downloads
+        the segment itself."""
+        content = None
+        try:
+            content = self.fetch(segment_url)
+        except requests.exceptions.RequestException as error:
+            self.log('Prefetch failed: %s' % error)
+        finally:
+            with self.lock:
+                if content is not None:
+                    self.segment_buffer[segment_url] = content
+                    while len(self.segment_buffer) > self.buffer_size:
+                        self.segment_buffer.popitem(last=False)
+                self.prefetching.pop(segment_url).set()
@@ -0,0 +1,64 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Keeps the FOX Sports GO session alive and the on-disk cache of a fsgolib instance warm
+"""
+import time
+
+
+class prefetcher(object):
+    def __init__(self, fsgo, get_deportes=None, interval=60, playing_interval=600, wait=None, is_playing=None,
+                 is_enabled=None):
+        """Prefetch into the cache of fsgo every interval seconds.
+        wait(seconds) should return True when the loop should stop, is_playing() backs the loop off to
+        playing_interval and only keeps the session alive while it returns True. All callables are optional
+        so the loop can be driven by tests or by a Kodi monitor."""
+        self.fsgo = fsgo
+        self.get_deportes = get_deportes or (lambda: 'true')
+        self.interval = interval
+        self.playing_interval = playing_interval
+        self.wait = wait or self.sleep
+        self.is_playing = is_playing or (lambda: False)
+        self.is_enabled = is_enabled or (lambda: True)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return False
+
+    def run(self):
+        while True:
+            if not self.is_enabled():
+                delay = self.interval
+            elif self.is_playing():
+                self.tick(prefetch=False)
+                delay = self.playing_interval
+            else:
+                self.tick()
+                delay = self.interval
+            if self.wait(delay):
+                break
+
+    def tick(self, prefetch=True):
+        """Refresh the session if it's about to expire and refresh every cached response that has expired.
+        Responses that are still fresh are served from the cache and cost no request."""
+        import requests
+        fsgo = self.fsgo
+        # errors are logged and the next tick tries again, e.g. a full disk must not stop the service for good
+        try:
+            fsgo.reload_credentials()  # the plugin may have logged in or refreshed the session since the last tick
+            if not fsgo.valid_session():
+                return
+            fsgo.keep_alive()
+            if prefetch:
+                deportes = self.get_deportes()
+                fsgo.get_schedule_data('live', deportes=deportes)
+                fsgo.get_schedule_data('featured', deportes=deportes)
+                fsgo.get_schedule_index(deportes)
+                fsgo.get_channels()
+        except (requests.exceptions.RequestException, fsgo.LoginFailure, ValueError, KeyError, IOError,
+                OSError) as error:
+            fsgo.log('Prefetch failed: %s' % error)
+        try:
+            fsgo.save_cookies()
+            fsgo.save_request_log()
+        except (IOError, OSError) as error:
+            fsgo.log('Failed to save cookies or request log: %s' % error)
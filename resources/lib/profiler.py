@@ -0,0 +1,79 @@
+﻿# -*- coding: utf-8 -*-
+"""
+Profiles add-on invocations and reports where the time went across them
+
+Usage: python profiler.py <profiles folder> [number of functions per action]
+"""
+import os
+import re
+import sys
+import time
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+# <action>-<milliseconds since epoch>.prof, other files in the profiles folder are ignored
+STATS_FILE_REGEX = re.compile(r'^(\w+)-(\d+)\.prof$')
+
+
+class profiler(object):
+    def __init__(self, profiles_folder, keep=20):
+        """Write one stats file per profiled invocation to profiles_folder.
+        The keep most recent ones of each action are kept."""
+        self.profiles_folder = profiles_folder
+        self.keep = keep
+
+    @contextmanager
+    def profile(self, action):
+        """Profile the guarded block and save the stats as <action>-<milliseconds since epoch>.prof.
+        action may only contain letters, digits and underscores."""
+        if not re.match(r'^\w+$', action):
+            raise ValueError('Invalid action name: %r' % action)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if not os.path.exists(self.profiles_folder):
+                os.makedirs(self.profiles_folder)
+            profile.dump_stats(os.path.join(self.profiles_folder, '%s-%d.prof' % (action, time.time() * 1000)))
+            for stats_file in self.get_stats_files(action)[:-self.keep]:
+                try:
+                    os.remove(stats_file)
+                except OSError:
+                    pass
+
+    def get_stats_files(self, action=None):
+        """Return the stats files of an action, or of all actions, oldest first."""
+        try:
+            filenames = os.listdir(self.profiles_folder)
+        except OSError:
+            return []
+        stats_files = []
+        for filename in filenames:
+            match = STATS_FILE_REGEX.match(filename)
+            if match and (action is None or match.group(1) == action):
+                stats_files.append((int(match.group(2)), os.path.join(self.profiles_folder, filename)))
+        return [stats_file for timestamp, stats_file in sorted(stats_files)]
+
+    def report(self, limit=20, stream=sys.stdout):
+        """Print the limit functions with the highest cumulative time of each action.
+        The stats of all invocations of an action are aggregated."""
+        actions = {}
+        for stats_file in self.get_stats_files():
+            action = STATS_FILE_REGEX.match(os.path.basename(stats_file)).group(1)
+            actions.setdefault(action, []).append(stats_file)
+
+        for action in sorted(actions):
+            stats = pstats.Stats(*actions[action], stream=stream)
+            invocations = len(actions[action])
+            stream.write('=== %s: %s invocation(s), %.3f s on average ===\n' % (action, invocations,
+                                                                            stats.total_tt / invocations))
+            stats.sort_stats('cumulative').print_stats(limit)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    profiler(sys.argv[1]).report(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
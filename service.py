@@ -0,0 +1,28 @@
+﻿# -*- coding: utf-8 -*-
+"""
+A Kodi service that keeps the FOX Sports GO session alive and prefetches schedules in the background
+"""
+import xbmc
+import xbmcaddon
+
+from resources.lib.fsgo import fsgolib
+from resources.lib.prefetcher import prefetcher
+
+
+def get_setting(setting_id):
+    return xbmcaddon.Addon().getSetting(setting_id)  # a new instance picks up changed settings
+
+
+if __name__ == '__main__':
+    addon = xbmcaddon.Addon()
+    addon_profile = xbmc.translatePath(addon.getAddonInfo('profile'))
+    monitor = xbmc.Monitor()
+    player = xbmc.Player()
+
+    fsgo = fsgolib(addon_profile, verify_ssl=get_setting('verify_ssl') != 'false',
+                   log_requests=get_setting('log_requests') == 'true')
+    prefetcher(fsgo,
+               get_deportes=lambda: get_setting('show_deportes'),
+               wait=monitor.waitForAbort,
+               is_playing=player.isPlayingVideo,
+               is_enabled=lambda: get_setting('background_prefetch') == 'true').run()